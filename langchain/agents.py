@@ -1,12 +1,18 @@
 import os
 import warnings
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from langchain.chains import RetrievalQA
 from langchain_community.document_loaders import PDFPlumberLoader
-from langchain_community.llms import Ollama
 from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_text_splitters import CharacterTextSplitter
 
+from nodeAI.utils.embeddings import EmbeddingPool
+from nodeAI.utils.ragtool import iter_chunks
+from nodeAI.utils.tool import similarity_search_batch
+from nodeAI.utils.llm_registry import LLMRegistry
+
 warnings.filterwarnings('ignore')
 
 class Document:
@@ -17,98 +23,125 @@ class Document:
         self.page_content = content
         self.metadata = metadata or {}
 
+def load_and_split(file_path):
+    """
+    Load a PDF or TXT file and split it into chunks (module level so it can run in worker processes).
+
+    :param file_path: Path to the file.
+    :return: List of chunks, or None if the file type is not supported.
+    """
+    if file_path.lower().endswith('.pdf'):
+        docs = PDFPlumberLoader(file_path).load()
+    elif file_path.lower().endswith('.txt'):
+        with open(file_path, 'r', encoding='utf-8') as file:
+            docs = [Document(content=file.read(), metadata={'source': file_path})]
+    else:
+        return None
+
+    text_splitter = CharacterTextSplitter(
+        separator="\n",
+        chunk_size=2000,
+        chunk_overlap=200
+    )
+    return text_splitter.split_documents(docs)
+
 class RAGTool:
-    def __init__(self, name: str, file_paths:list):
+    def __init__(self, name: str, file_paths:list, workers: int = 1, batch_size: int = 64):
         """
         Initialize the RAGTool class with a list of file paths.
         
         :param file_paths: List of paths to the files to be loaded and processed.
+        :param workers: Number of worker processes used to parse and split the files (1 = no worker processes).
+        :param batch_size: Number of chunks embedded and added to the index at once.
         """
         self.name = name
         self.file_paths = file_paths
-        self.documents = []
-        self.embeddings = HuggingFaceEmbeddings()
+        self.workers = workers
+        self.batch_size = batch_size
+        self.embeddings = EmbeddingPool.acquire()
         self.db = None
         self.load_files()
+
+    def release(self):
+        """
+        Release the shared embedding model held by this tool.
+        """
+        if self.embeddings is not None:
+            EmbeddingPool.release(self.embeddings)
+            self.embeddings = None
     
     def load_files(self):
         """
         Load and process a list of files based on their suffixes.
-        
-        :param file_paths: List of paths to the files.
+
+        The chunks go into the FAISS index in batches of self.batch_size, they are not collected.
+        Without worker processes the files are read lazily (page by page or block by block);
+        a worker process returns the chunks of a whole file.
         """
-        for file_path in self.file_paths:
-            if file_path.lower().endswith('.pdf'):
-                self.load_pdf(file_path)
-            elif file_path.lower().endswith('.txt'):
-                self.load_txt(file_path)
-            else:
-                print(f"Unsupported file type: {file_path}")
-        
-        # Final reprocessing after all files are loaded
-        self._reprocess_documents()
+        if self.workers > 1 and len(self.file_paths) > 1:
+            # Parse and split in worker processes, map() returns the chunks in file order
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                for file_path, texts in zip(self.file_paths, executor.map(load_and_split, self.file_paths)):
+                    if texts is None:
+                        print(f"Unsupported file type: {file_path}")
+                        continue
+                    print(f"   {self.name} - Adding {len(texts)} chunks from {file_path} to the collection...")
+                    self._add_chunks(texts)
+        else:
+            for file_path in self.file_paths:
+                if file_path.lower().endswith('.pdf'):
+                    self.load_pdf(file_path)
+                elif file_path.lower().endswith('.txt'):
+                    self.load_txt(file_path)
+                else:
+                    print(f"Unsupported file type: {file_path}")
+
+        if self.db is None:
+            raise RuntimeError("No documents loaded. Please load at least one document.")
+        # Print the number of documents in FAISS index using ntotal
+        print(f"   {self.name} - Number of chunks in FAISS index: {self.db.index.ntotal}")
     
     def load_pdf(self, file_path):
         """
-        Load and process a single PDF file.
+        Load and process a single PDF file, page by page.
         
         :param file_path: Path to the PDF file.
         """
-        loader = PDFPlumberLoader(file_path)
-        docs = loader.load()
-        
-        print(f"   {self.name} - Splitting into chunks from PDF...")
-        text_splitter = CharacterTextSplitter(
-            separator="\n",
-            chunk_size=2000,
-            chunk_overlap=200
-        )
-        texts = text_splitter.split_documents(docs)
-        print(f"   {self.name} - Number of chunks: {len(texts)}")
-        for text in texts:
-            print("   {self.name} - Content: ", text.page_content.replace('\n', '')[:50])
-
         print(f"   {self.name} - Adding PDF chunks to the collection...")
-        self.documents.extend(texts)
+        count = self._add_chunks(iter_chunks(file_path))
+        print(f"   {self.name} - Number of chunks: {count}")
     
     def load_txt(self, file_path):
         """
-        Load and process a single text file.
+        Load and process a single text file, block by block.
         
         :param file_path: Path to the text file.
         """
-        with open(file_path, 'r', encoding='utf-8') as file:
-            text = file.read()
-        
-        # Wrap text in a Document-like object with metadata
-        print(f"   {self.name} - Splitting into chunks from TXT...")
-        document = Document(content=text, metadata={'source': file_path})
-        text_splitter = CharacterTextSplitter(
-            separator="\n",
-            chunk_size=2000,
-            chunk_overlap=200
-        )
-        texts = text_splitter.split_documents([document])
-        print(f"   {self.name} - Number of chunks: {len(texts)}")
-        for text in texts:
-            print("   {self.name} - Content: ", text.page_content.replace('\n', '')[:50])
-
         print(f"   {self.name} - Adding TXT chunks to the collection...")
-        self.documents.extend(texts)
-    
-    def _reprocess_documents(self):
+        count = self._add_chunks(iter_chunks(file_path))
+        print(f"   {self.name} - Number of chunks: {count}")
+
+    def _add_chunks(self, chunks):
         """
-        Recreate the FAISS index based on the updated documents.
+        Embed chunks in batches and add them to the FAISS index.
+
+        :param chunks: Iterable of chunks, may be a generator.
+        :return: Number of chunks added.
         """
-        if not self.documents:
-            raise RuntimeError("No documents loaded. Please load at least one document.")
-        
-        print(f"   {self.name} - Creating embeddings for document chunks...")
-        self.db = FAISS.from_documents(self.documents, self.embeddings)
-        
-        # Print the number of documents in FAISS index using ntotal
-        num_documents = self.db.index.ntotal
-        print(f"   {self.name} - Number of chunks in FAISS index: {num_documents}")
+        count = 0
+        chunks = iter(chunks)
+        while True:
+            batch = list(islice(chunks, self.batch_size))
+            if not batch:
+                return count
+            vectors = self.embeddings.embed_documents([chunk.page_content for chunk in batch])
+            text_embeddings = [(chunk.page_content, vector) for chunk, vector in zip(batch, vectors)]
+            metadatas = [chunk.metadata for chunk in batch]
+            if self.db is None:
+                self.db = FAISS.from_embeddings(text_embeddings, self.embeddings, metadatas=metadatas)
+            else:
+                self.db.add_embeddings(text_embeddings, metadatas=metadatas)
+            count += len(batch)
 
     def get_document_retriever(self):
         """
@@ -121,24 +154,26 @@ class RAGTool:
         return self.db.as_retriever()
 
 class Agent:
-    def __init__(self, name: str, model: str, rag_tool: RAGTool = None):
+    def __init__(self, name: str, model: str, rag_tool: RAGTool = None, max_results: int = 100):
         """
         Initialize the Agent class with a specific model and optionally with RAGTool for document processing.
         
         :param model: The model name for the language model.
         :param rag_tool: An optional RAGTool instance for document processing.
+        :param max_results: Number of previous results kept, the oldest are dropped first.
         """
         self.agent_name = name
         self.model_name = model
         self.rag_tool = rag_tool
         self.chain = None
-        self.previous_results = {}  # Store results of previous queries
+        self.max_results = max_results
+        self.previous_results = OrderedDict()  # Store results of previous queries (bounded)
     
     def setup_chain(self):
         """
         Set up the retrieval chain using the document retriever from RAGTool if provided.
         """
-        llm = Ollama(model=self.model_name)
+        llm = LLMRegistry.get('Ollama', self.model_name)
         if self.rag_tool:
             retriever = self.rag_tool.get_document_retriever()
             self.chain = RetrievalQA.from_chain_type(llm,retriever=retriever)
@@ -161,75 +196,121 @@ class Agent:
         final_query = f"{context}\n\n{question}" if context else question
         
         print(f"{self.agent_name} - Query: {final_query}")
-        if isinstance(self.chain, Ollama):
+        if not self.rag_tool:
             # For direct LLM query without retrieval
-            result = self.chain(final_query)
+            result = self.chain.invoke(final_query)
         else:
             # For RetrievalQA with retriever
             result = self.chain.invoke({"query": final_query})
         
         # Store the result of the query
         self.previous_results[question] = result['result'] if isinstance(result, dict) else result
+        self.previous_results.move_to_end(question)
+        while len(self.previous_results) > self.max_results:
+            self.previous_results.popitem(last=False)
         
         return result['result'] if isinstance(result, dict) else result
 
+    def query_batch(self, questions: list, context: str = None, k: int = 4, max_concurrency: int = 4):
+        """
+        Query the model with many questions at once.
+
+        With a RAGTool, all questions are embedded in one batch and retrieved with one FAISS search.
+        The LLM calls are dispatched with bounded concurrency.
+        
+        :param questions: List of questions.
+        :param context: Optional context to be included in every query.
+        :param k: Number of documents retrieved per question.
+        :param max_concurrency: Maximum number of LLM calls running at the same time.
+        :return: List of dicts with question, result and error (None on success), in the order of the questions.
+        """
+        if not self.chain:
+            raise RuntimeError("Chain not set up. Please call setup_chain() before querying.")
+
+        final_queries = [f"{context}\n\n{question}" if context else question for question in questions]
+        config = {"max_concurrency": max_concurrency}
+        print(f"{self.agent_name} - Batch query: {len(questions)} questions")
+        if self.rag_tool:
+            documents = similarity_search_batch(self.rag_tool.db, self.rag_tool.embeddings, final_queries, k)
+            outputs = self.chain.combine_documents_chain.batch(
+                [{"input_documents": docs, "question": query} for query, docs in zip(final_queries, documents)],
+                config=config, return_exceptions=True
+            )
+        else:
+            outputs = self.chain.batch(final_queries, config=config, return_exceptions=True)
+
+        results = []
+        for question, output in zip(questions, outputs):
+            if isinstance(output, Exception):
+                results.append({"question": question, "result": None, "error": str(output)})
+                continue
+            result = output["output_text"] if isinstance(output, dict) else output
+            self.previous_results[question] = result
+            self.previous_results.move_to_end(question)
+            results.append({"question": question, "result": result, "error": None})
+        while len(self.previous_results) > self.max_results:
+            self.previous_results.popitem(last=False)
+        return results
+
 
 # Example usage:
 
-# Initialize RAGTools
-print("--------------------------")
-print(f"Tool 1")
-print("--------------------------")
-tool1 = RAGTool(
-    name ="tool1",
-    file_paths=[
-    "/Users/markusfreyt/Development/Projects/AI/langchain/docs/TPLINK1.txt"
-    ]
-)
-
-print("--------------------------")
-print(f"Tool 2")
-print("--------------------------")
-tool2 = RAGTool(
-    name ="tool2",
-    file_paths=[
-    "/Users/markusfreyt/Development/Projects/AI/langchain/docs/TPLINK2.txt"
-    ]
-)
-
-# Initialize and set up Agents
-agent1 = Agent(name="agent1", model="llama3.1", rag_tool=tool1)
-agent2 = Agent(name="agent2", model="llama3.1", rag_tool=tool2)
-agent3 = Agent(name="agent3", model="llama3.1")
-
-agent1.setup_chain()
-agent2.setup_chain()
-agent3.setup_chain()
-
-print("--------------------------")
-print(f"Agent 1")
-print("--------------------------")
-first_query_agent1 = "What is the price of this product and summarize its features?"
-first_result_agent1 = agent1.query(first_query_agent1)
-print("--------------------------")
-print(f"Result: {first_result_agent1}")
-print("--------------------------")
-
-print("--------------------------")
-print(f"Agent 2")
-print("--------------------------")
-first_query_agent2 = "What is the price of this product and summarize its features?"
-first_result_agent2 = agent2.query(first_query_agent2)
-print("--------------------------")
-print(f"Result: {first_result_agent2}")
-print("--------------------------")
-
-print("--------------------------")
-print(f"Agent 3")
-print("--------------------------")
-summary_query = "Based on the output from Agent1 and Agent2, name the cheaper product and summarize its features."
-context = f"Agent 1 Result: {first_result_agent1}\n\nAgent 2 Result: {first_result_agent2}"
-summary_result = agent3.query(summary_query, context=context)
-print("--------------------------")
-print(f"Result: {summary_result}")
-print("--------------------------")
+# Guarded so worker processes (spawned on macOS/Windows) do not run the example again
+if __name__ == "__main__":
+    # Initialize RAGTools
+    print("--------------------------")
+    print(f"Tool 1")
+    print("--------------------------")
+    tool1 = RAGTool(
+        name ="tool1",
+        file_paths=[
+        "/Users/markusfreyt/Development/Projects/AI/langchain/docs/TPLINK1.txt"
+        ]
+    )
+
+    print("--------------------------")
+    print(f"Tool 2")
+    print("--------------------------")
+    tool2 = RAGTool(
+        name ="tool2",
+        file_paths=[
+        "/Users/markusfreyt/Development/Projects/AI/langchain/docs/TPLINK2.txt"
+        ]
+    )
+
+    # Initialize and set up Agents
+    agent1 = Agent(name="agent1", model="llama3.1", rag_tool=tool1)
+    agent2 = Agent(name="agent2", model="llama3.1", rag_tool=tool2)
+    agent3 = Agent(name="agent3", model="llama3.1")
+
+    agent1.setup_chain()
+    agent2.setup_chain()
+    agent3.setup_chain()
+
+    print("--------------------------")
+    print(f"Agent 1")
+    print("--------------------------")
+    first_query_agent1 = "What is the price of this product and summarize its features?"
+    first_result_agent1 = agent1.query(first_query_agent1)
+    print("--------------------------")
+    print(f"Result: {first_result_agent1}")
+    print("--------------------------")
+
+    print("--------------------------")
+    print(f"Agent 2")
+    print("--------------------------")
+    first_query_agent2 = "What is the price of this product and summarize its features?"
+    first_result_agent2 = agent2.query(first_query_agent2)
+    print("--------------------------")
+    print(f"Result: {first_result_agent2}")
+    print("--------------------------")
+
+    print("--------------------------")
+    print(f"Agent 3")
+    print("--------------------------")
+    summary_query = "Based on the output from Agent1 and Agent2, name the cheaper product and summarize its features."
+    context = f"Agent 1 Result: {first_result_agent1}\n\nAgent 2 Result: {first_result_agent2}"
+    summary_result = agent3.query(summary_query, context=context)
+    print("--------------------------")
+    print(f"Result: {summary_result}")
+    print("--------------------------")
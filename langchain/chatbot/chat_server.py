@@ -0,0 +1,155 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from session_manager import SessionManager
+
+class ChatServer:
+    """
+    Asynchroner HTTP-Server, der die Antworten des Chat-Modells als Server-Sent Events streamt.
+
+    POST /chat mit {"session_id": ..., "message": ...} liefert "data: {"token": ...}" Events und
+    zum Schluss ein Event mit "done" und der Zeit bis zum ersten Token (TTFT).
+    GET /stats liefert die TTFT-Statistik, GET /health prüft, ob der Server läuft.
+    """
+    def __init__(self, model, prompt, session_manager, summarize=None, max_tokens=2000, keep_turns=3):
+        """
+        :param model: Chat-Modell mit astream() (z.B. ChatGroq oder ein Fake-Modell für Tests).
+        :param prompt: ChatPromptTemplate mit dem Platzhalter "messages".
+        :param session_manager: SessionManager für die Historie der Sessions.
+        :param summarize: Optionale Funktion zum Zusammenfassen älterer Nachrichten, siehe SessionManager.get_window.
+        :param max_tokens: Token-Budget der wörtlich übernommenen Historie.
+        :param keep_turns: Anzahl der wörtlich übernommenen Runden.
+        """
+        self.model = model
+        self.prompt = prompt
+        self.session_manager = session_manager
+        self.summarize = summarize
+        self.max_tokens = max_tokens
+        self.keep_turns = keep_turns
+        self.ttft = []
+
+    async def stream_response(self, session_id, message):
+        """
+        Streamt die Antwort auf eine Nachricht und speichert Frage und Antwort in der Historie.
+
+        :return: Async-Generator der Tokens.
+        """
+        await self.session_manager.aadd_message(session_id, {"type": "human", "content": message})
+        history = await asyncio.to_thread(
+            self.session_manager.get_window, session_id, self.max_tokens, self.keep_turns, self.summarize
+        )
+        formatted_prompt = await self.prompt.ainvoke({"messages": [self.session_manager.dict_to_message(m) for m in history]})
+
+        response_content = ""
+        async for chunk in self.model.astream(formatted_prompt.messages):
+            response_content += chunk.content
+            yield chunk.content
+
+        await self.session_manager.aadd_message(session_id, {"type": "ai", "content": response_content})
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            method, target, _ = request_line.decode('latin-1').split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode('latin-1').partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            path = urlsplit(target).path
+
+            if method == "POST" and path == "/chat":
+                await self._handle_chat(json.loads(body or b"{}"), writer)
+            elif method == "GET" and path == "/stats":
+                await self._send_json(writer, 200, self.get_stats())
+            elif method == "GET" and path == "/health":
+                await self._send_json(writer, 200, {"status": "ok"})
+            else:
+                await self._send_json(writer, 404, {"error": f"Not found: {method} {path}"})
+        except (ValueError, json.JSONDecodeError, asyncio.IncompleteReadError) as e:
+            await self._send_json(writer, 400, {"error": str(e)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_chat(self, request, writer):
+        session_id = request.get("session_id")
+        message = request.get("message")
+        if not session_id or not message:
+            await self._send_json(writer, 400, {"error": "session_id and message are required"})
+            return
+
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        start = time.perf_counter()
+        ttft = None
+        try:
+            async for token in self.stream_response(session_id, message):
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                    self.ttft.append(ttft)
+                writer.write(f"data: {json.dumps({'token': token})}\n\n".encode('utf-8'))
+                await writer.drain()
+            total = time.perf_counter() - start
+            print(f"{session_id} - TTFT: {ttft * 1000 if ttft else 0:.0f} ms, Total: {total * 1000:.0f} ms")
+            writer.write(f"data: {json.dumps({'done': True, 'ttft': ttft, 'total': total})}\n\n".encode('utf-8'))
+        except ConnectionError:
+            raise
+        except Exception as e:
+            print(f"Fehler: {e}")
+            writer.write(f"data: {json.dumps({'error': str(e)})}\n\n".encode('utf-8'))
+        await writer.drain()
+
+    async def _send_json(self, writer, status, data):
+        body = json.dumps(data).encode('utf-8')
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found"}.get(status, "")
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body)
+        await writer.drain()
+
+    def get_stats(self):
+        """Liefert Anzahl, Mittelwert und Median der Zeit bis zum ersten Token in Millisekunden."""
+        if not self.ttft:
+            return {"requests": 0}
+        return {
+            "requests": len(self.ttft),
+            "ttft_avg_ms": statistics.mean(self.ttft) * 1000,
+            "ttft_p50_ms": statistics.median(self.ttft) * 1000,
+        }
+
+    async def serve(self, host="127.0.0.1", port=8000):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Chat-Server läuft auf http://{host}:{port} (POST /chat)")
+        async with server:
+            await server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streaming Chat-Server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--fake", action="store_true", help="Lokales Fake-Modell statt ChatGroq verwenden (Tests)")
+    args = parser.parse_args()
+
+    if args.fake:
+        from langchain_core.language_models import FakeListChatModel
+        model = FakeListChatModel(responses=["Hallo! Das ist eine Testantwort des Fake-Modells."])
+        prompt = ChatPromptTemplate.from_messages([MessagesPlaceholder(variable_name="messages")])
+        # Eigenes temporäres Verzeichnis, damit Tests die echte Historie nicht verändern
+        history_directory = tempfile.mkdtemp(prefix="chat_server_fake_")
+        print(f"Fake-Historie in {history_directory}")
+        server = ChatServer(model, prompt, SessionManager(os.path.join(history_directory, "session_history.json")))
+    else:
+        # Gleiches Modell, gleicher Prompt und gleiche Sessions wie chatbot.py
+        from chatbot import model, prompt, session_manager, summarize_history
+        server = ChatServer(model, prompt, session_manager, summarize=summarize_history)
+
+    asyncio.run(server.serve(args.host, args.port))
@@ -21,12 +21,23 @@ prompt = ChatPromptTemplate.from_messages(
 # Initialisieren des SessionManagers
 session_manager = SessionManager("session_history.json")
 
+def summarize_history(summary, messages):
+    """Aktualisiert die Zusammenfassung älterer Nachrichten, damit der Prompt nicht mit der Session wächst."""
+    conversation = "\n".join(f"{m['type']}: {m['content']}" for m in messages)
+    response = model.invoke([
+        ("system", "Fasse das bisherige Gespräch knapp zusammen. Behalte wichtige Fakten, Namen und Zahlen."),
+        ("human", f"Bisherige Zusammenfassung:\n{summary}\n\nNeue Nachrichten:\n{conversation}"),
+    ])
+    return response.content
+
 def response_with_template(session_id, message):
     try:
         # Nachrichten zur Historie hinzufügen
-        history = session_manager.get_history(session_id)
         message_dict = {"type": "human", "content": message}
         session_manager.add_message(session_id, message_dict)
+
+        # Letzte Runden wörtlich, ältere Nachrichten als Zusammenfassung
+        history = session_manager.get_window(session_id, max_tokens=2000, keep_turns=3, summarize=summarize_history, summarize_tokens=1000)
         
         # Formatieren des Prompts
         formatted_prompt = prompt.invoke({"messages": [session_manager.dict_to_message(m) for m in history]})
@@ -35,12 +35,23 @@ parser = StrOutputParser()
 # Create the chain
 chain = prompt | model | parser
 
+def summarize_history(summary, messages):
+    """Update the summary of older messages so the prompt does not grow with the session."""
+    conversation = "\n".join(f"{m['type']}: {m['content']}" for m in messages)
+    response = model.invoke([
+        ("system", "Fasse das bisherige Gespräch knapp zusammen. Behalte wichtige Fakten, Namen und Zahlen."),
+        ("human", f"Bisherige Zusammenfassung:\n{summary}\n\nNeue Nachrichten:\n{conversation}"),
+    ])
+    return response.content
+
 def response_with_template(session_id, message):
     try:
         # Add message to history
-        history = session_manager.get_history(session_id)
         message_dict = {"type": "human", "content": message}
         session_manager.add_message(session_id, message_dict)
+
+        # Last turns verbatim, older messages as a rolling summary
+        history = session_manager.get_window(session_id, max_tokens=2000, keep_turns=3, summarize=summarize_history, summarize_tokens=1000)
         
         # Prepare the messages for the prompt
         formatted_messages = [session_manager.dict_to_message(m) for m in history]
@@ -1,34 +1,225 @@
+import asyncio
 import json
 import os
+import threading
+from collections import OrderedDict
+from urllib.parse import quote
+
+try:
+    import fcntl
+except ImportError:
+    # Keine Dateisperren unter Windows, dann ist nur ein Prozess pro Verzeichnis sicher
+    fcntl = None
 
 class SessionManager:
-    def __init__(self, filename):
+    def __init__(self, filename, backend="jsonl", max_sessions=1000):
+        """
+        :param filename: Name der Sessions-Datei, beim Backend "jsonl" bestimmt sie den Namen des Verzeichnisses.
+        :param backend: "jsonl" (eine Log-Datei pro Session, Nachrichten werden angehängt, sicher bei mehreren Prozessen)
+                        oder "json" (alle Sessions in einer Datei, wird bei jeder Nachricht neu geschrieben).
+        :param max_sessions: Maximale Anzahl der Sessions im Speicher (LRU), nur beim Backend "jsonl", mindestens 1.
+        """
+        if max_sessions < 1:
+            raise ValueError(f"max_sessions must be at least 1, got {max_sessions}")
         self.directory = os.path.dirname(os.path.abspath(__file__))
         self.filename = os.path.join(self.directory, filename)
-        self.load_sessions()
-    
+        self.backend = backend
+        self.max_sessions = max_sessions
+        self._lock = threading.RLock()
+        # Zusammenfassungen älterer Nachrichten je Session: {"summary": str, "covered": Anzahl Nachrichten}
+        self.summaries = {}
+        if self.backend == "jsonl":
+            self.sessions = OrderedDict()
+            # Gelesene Bytes je Session-Log, um Nachrichten anderer Prozesse nachzuladen
+            self.offsets = {}
+            self.session_directory = os.path.splitext(self.filename)[0]
+            self.migrate_sessions()
+        elif self.backend == "json":
+            self.load_sessions()
+        else:
+            raise ValueError(f"Unknown backend: {backend}")
+
     def load_sessions(self):
         try:
             with open(self.filename, 'r') as f:
                 self.sessions = json.load(f)
         except FileNotFoundError:
             self.sessions = {}
-    
+
     def save_sessions(self):
         with open(self.filename, 'w') as f:
             json.dump(self.sessions, f, indent=4)
-    
-    def get_history(self, session_id):
+
+    def migrate_sessions(self):
+        """Übernimmt eine vorhandene JSON-Datei einmalig in das Verzeichnis mit den Session-Logs."""
+        try:
+            os.makedirs(self.session_directory)
+        except FileExistsError:
+            return
+        try:
+            with open(self.filename, 'r') as f:
+                sessions = json.load(f)
+        except FileNotFoundError:
+            return
+        for session_id, messages in sessions.items():
+            with open(self._session_path(session_id), 'a', encoding='utf-8') as f:
+                for message_dict in messages:
+                    f.write(json.dumps(message_dict) + "\n")
+
+    def _session_path(self, session_id):
+        return os.path.join(self.session_directory, quote(session_id, safe='') + ".jsonl")
+
+    def _lock_file(self, f, exclusive):
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+    def _read_new_messages(self, f, session_id):
+        """Liest die Nachrichten ab der zuletzt gelesenen Position, unvollständige Zeilen werden ignoriert."""
+        f.seek(self.offsets.get(session_id, 0))
+        messages = []
+        for line in f:
+            try:
+                messages.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        self.offsets[session_id] = f.tell()
+        return messages
+
+    def _cache_session(self, session_id):
+        """Lädt eine Session in den LRU-Cache bzw. ergänzt Nachrichten, die andere Prozesse angehängt haben."""
+        path = self._session_path(session_id)
         if session_id not in self.sessions:
             self.sessions[session_id] = []
+            self.offsets[session_id] = 0
+        self.sessions.move_to_end(session_id)
+        while len(self.sessions) > self.max_sessions:
+            evicted, _ = self.sessions.popitem(last=False)
+            self.offsets.pop(evicted, None)
+
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return self.sessions[session_id]
+        if size > self.offsets[session_id]:
+            with open(path, 'rb') as f:
+                self._lock_file(f, exclusive=False)
+                self.sessions[session_id].extend(self._read_new_messages(f, session_id))
         return self.sessions[session_id]
-    
+
+    def get_history(self, session_id):
+        with self._lock:
+            if self.backend == "jsonl":
+                return self._cache_session(session_id)
+            if session_id not in self.sessions:
+                self.sessions[session_id] = []
+            return self.sessions[session_id]
+
     def add_message(self, session_id, message_dict):
-        if session_id not in self.sessions:
-            self.sessions[session_id] = []
-        self.sessions[session_id].append(message_dict)
-        self.save_sessions()
-    
+        with self._lock:
+            if self.backend == "json":
+                self.get_history(session_id).append(message_dict)
+                self.save_sessions()
+                return
+
+            history = self._cache_session(session_id)
+            # Nur die neue Nachricht anhängen, unabhängig von der Anzahl der Sessions.
+            # Unter der Sperre werden vorher die Nachrichten anderer Prozesse nachgeladen.
+            with open(self._session_path(session_id), 'ab+') as f:
+                self._lock_file(f, exclusive=True)
+                history.extend(self._read_new_messages(f, session_id))
+                line = (json.dumps(message_dict) + "\n").encode('utf-8')
+                if f.tell() > 0:
+                    # Eine unvollständige letzte Zeile abschließen, damit die neue Nachricht lesbar bleibt
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        line = b"\n" + line
+                f.seek(0, os.SEEK_END)
+                f.write(line)
+                f.flush()
+                self.offsets[session_id] = f.tell()
+            history.append(message_dict)
+
+    async def aget_history(self, session_id):
+        """Asynchrone Variante von get_history für asyncio-Server."""
+        return await asyncio.to_thread(self.get_history, session_id)
+
+    async def aadd_message(self, session_id, message_dict):
+        """Asynchrone Variante von add_message für asyncio-Server."""
+        await asyncio.to_thread(self.add_message, session_id, message_dict)
+
+    def count_tokens(self, message_dict):
+        """Schätzt die Anzahl der Tokens einer Nachricht (ca. 4 Zeichen pro Token)."""
+        return len(message_dict.get("content") or "") // 4 + 4
+
+    def _summary_path(self, session_id):
+        return os.path.join(self.session_directory, quote(session_id, safe='') + ".summary.json")
+
+    def _get_summary(self, session_id):
+        if session_id not in self.summaries:
+            self.summaries[session_id] = {"summary": "", "covered": 0}
+            if self.backend == "jsonl":
+                try:
+                    with open(self._summary_path(session_id), 'r', encoding='utf-8') as f:
+                        self.summaries[session_id] = json.load(f)
+                except (FileNotFoundError, json.JSONDecodeError):
+                    pass
+        return self.summaries[session_id]
+
+    def _save_summary(self, session_id, summary):
+        self.summaries[session_id] = summary
+        if self.backend == "jsonl":
+            path = self._summary_path(session_id)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(summary, f)
+            os.replace(tmp_path, path)
+
+    def get_window(self, session_id, max_tokens=2000, keep_turns=3, summarize=None, summarize_tokens=1000):
+        """
+        Liefert die Historie für den Prompt: die letzten Nachrichten wörtlich innerhalb eines Token-Budgets,
+        ältere Nachrichten als fortlaufend aktualisierte Zusammenfassung.
+
+        :param session_id: ID der Session.
+        :param max_tokens: Token-Budget für die wörtlich übernommenen Nachrichten.
+        :param keep_turns: Maximale Anzahl der wörtlich übernommenen Runden (Frage und Antwort).
+        :param summarize: Optionale Funktion summarize(bisherige_zusammenfassung, neue_nachrichten) -> str.
+                          Sie wird nur für Nachrichten aufgerufen, die seit der letzten Zusammenfassung aus dem Fenster gefallen sind.
+        :param summarize_tokens: Zusammengefasst wird erst, wenn diese Nachrichten mehr als summarize_tokens Token umfassen.
+                                 Bis dahin bleiben sie wörtlich im Fenster, so fällt nicht in jeder Runde ein Aufruf von summarize an.
+        :return: Liste von Nachrichten-Dictionaries, ggf. beginnend mit einer System-Nachricht mit der Zusammenfassung.
+        """
+        with self._lock:
+            history = list(self.get_history(session_id))
+        summary = self._get_summary(session_id)
+
+        # Bereits zusammengefasste Nachrichten werden nicht wieder wörtlich übernommen
+        start = len(history)
+        tokens = 0
+        while start > summary["covered"] and len(history) - start < keep_turns * 2:
+            message_tokens = self.count_tokens(history[start - 1])
+            # Die letzte Nachricht wird immer übernommen
+            if start < len(history) and tokens + message_tokens > max_tokens:
+                break
+            tokens += message_tokens
+            start -= 1
+        window = history[start:]
+
+        if summarize and start > summary["covered"]:
+            overflow = history[summary["covered"]:start]
+            if sum(self.count_tokens(message) for message in overflow) > summarize_tokens:
+                summary = {
+                    "summary": summarize(summary["summary"], overflow),
+                    "covered": start
+                }
+                self._save_summary(session_id, summary)
+            else:
+                # Noch nicht zusammengefasste Nachrichten bleiben wörtlich im Fenster
+                window = history[summary["covered"]:]
+
+        if summary["summary"]:
+            return [{"type": "system", "content": f"Zusammenfassung des bisherigen Gesprächs: {summary['summary']}"}] + window
+        return window
+
     def message_to_dict(self, message):
         """Konvertiert eine Nachricht in ein Dictionary."""
         return {
@@ -40,10 +231,12 @@ class SessionManager:
         """Konvertiert ein Dictionary in eine Nachricht."""
         message_type = message_dict.get("type")
         content = message_dict.get("content")
-        
+
         if message_type == "human":
             return {"type": "human", "content": content}
         elif message_type == "ai":
             return {"type": "ai", "content": content}
+        elif message_type == "system":
+            return {"type": "system", "content": content}
         else:
             raise ValueError(f"Unknown message type: {message_type}")
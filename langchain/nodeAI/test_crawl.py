@@ -0,0 +1,152 @@
+import asyncio
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from langchain_community.embeddings import FakeEmbeddings
+
+from utils import WebTool
+from utils.embeddings import EmbeddingPool
+
+# Site served by the local test server: path -> links on the page
+PAGES = {
+    '/': ['/a.html', '/b/', '/c.html', '/d.html', '/e.html', '/f.html', '/file.pdf', 'http://localhost:{port}/external.html'],
+    '/a.html': ['/deep.html'],
+    '/b/': [],
+    '/c.html': [],
+    '/d.html': [],
+    '/e.html': [],
+    '/f.html': [],
+    '/deep.html': [],
+}
+# Page texts differing from 'Page <path>'
+TEXTS = {}
+
+class SiteHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, time.monotonic()))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.delay)
+            if self.path not in PAGES:
+                self.send_response(404)
+                self.end_headers()
+                return
+            links = ''.join(f'<a href="{link.format(port=server.server_port)}">link</a>' for link in PAGES[self.path])
+            body = f"<html><body><p>{TEXTS.get(self.path, 'Page ' + self.path)}</p>{links}</body></html>".encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+class CrawlTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), SiteHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.in_flight = 0
+        self.server.max_in_flight = 0
+        self.server.delay = 0.0
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        # Index with fake vectors, the crawl is tested and not the embedding model
+        embeddings = FakeEmbeddings(size=16)
+        patches = [mock.patch.object(EmbeddingPool, 'acquire', return_value=embeddings),
+                   mock.patch.object(EmbeddingPool, 'release')]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def crawl(self, **kwargs):
+        tool = WebTool(name="crawl", urls=[self.base_url + '/'], **kwargs)
+        self.addCleanup(tool.release)
+        return tool
+
+    def requested_paths(self):
+        return [path for path, _ in self.server.requests]
+
+    def test_max_depth(self):
+        tool = self.crawl(follow_redirects=True, max_depth=0)
+        self.assertEqual(tool.get_sources(), [self.base_url + '/'])
+
+        tool = self.crawl(follow_redirects=True, max_depth=1)
+        self.assertIn(self.base_url + '/a.html', tool.get_sources())
+        self.assertIn(self.base_url + '/b/', tool.get_sources())
+        self.assertNotIn(self.base_url + '/deep.html', tool.get_sources())
+
+        tool = self.crawl(follow_redirects=True, max_depth=2)
+        self.assertIn(self.base_url + '/deep.html', tool.get_sources())
+
+    def test_same_domain_filtering(self):
+        tool = self.crawl(follow_redirects=True, max_depth=1)
+        self.assertEqual(len(tool.get_sources()), 7)
+        self.assertNotIn('/external.html', self.requested_paths())
+        self.assertNotIn('/file.pdf', self.requested_paths())
+
+    def test_concurrency(self):
+        self.server.delay = 0.2
+        self.crawl(follow_redirects=True, max_depth=1, concurrency=2, requests_per_second=0)
+        self.assertEqual(self.server.max_in_flight, 2)
+
+    def test_requests_per_second(self):
+        self.crawl(follow_redirects=True, max_depth=1, concurrency=8, requests_per_second=10)
+        starts = sorted(start for _, start in self.server.requests)
+        self.assertEqual(len(starts), 7)
+        # 10 requests per second per host: single requests may be delayed by the thread pool, the overall span may not be shorter
+        self.assertGreaterEqual(starts[-1] - starts[0], (len(starts) - 1) / 10 - 0.05)
+
+    def test_page_error(self):
+        parse_page = WebTool._parse_page
+        def failing_parse_page(tool, url, html):
+            if url.endswith('/c.html'):
+                raise RuntimeError("broken page")
+            return parse_page(tool, url, html)
+        with mock.patch.object(WebTool, '_parse_page', failing_parse_page):
+            tool = self.crawl(follow_redirects=True, max_depth=1)
+        self.assertEqual(len(tool.get_sources()), 7)
+        self.assertNotIn(self.base_url + '/c.html', tool.manifest)
+        self.assertIn(self.base_url + '/d.html', tool.manifest)
+
+    def test_recrawl_keeps_unchanged_pages(self):
+        tool = self.crawl(follow_redirects=True, max_depth=1)
+        ids = {source: entry['ids'] for source, entry in tool.manifest.items()}
+        links = dict(PAGES, **{'/': [link for link in PAGES['/'] if link != '/f.html']})
+        with mock.patch.dict(PAGES, links), mock.patch.dict(TEXTS, {'/c.html': "Changed text"}), \
+                mock.patch.object(FakeEmbeddings, 'embed_documents', autospec=True, side_effect=FakeEmbeddings.embed_documents) as embed_documents:
+            tool.sources = [self.base_url + '/']
+            tool.load()
+
+        # Only the changed pages are embedded again (the start page lost a link), the page no longer linked is removed
+        self.assertEqual(sum(len(call.args[1]) for call in embed_documents.call_args_list), 2)
+        self.assertNotIn(self.base_url + '/f.html', tool.manifest)
+        for page in ('/', '/c.html'):
+            self.assertNotEqual(tool.manifest[self.base_url + page]['ids'], ids[self.base_url + page])
+        for page in ('/a.html', '/b/', '/d.html', '/e.html'):
+            self.assertEqual(tool.manifest[self.base_url + page]['ids'], ids[self.base_url + page])
+        self.assertEqual(tool.db.index.ntotal, 6)
+
+    def test_load_in_running_loop(self):
+        async def create():
+            return self.crawl(follow_redirects=True, max_depth=1)
+        tool = asyncio.run(create())
+        self.assertEqual(len(tool.get_sources()), 7)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,7 @@ import os
 import warnings
 import json
 
-from utils import Agent, RAGTool
+from utils import Agent, RAGTool, Pipeline, LLMRegistry
 
 warnings.filterwarnings('ignore')
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
@@ -38,49 +38,35 @@ tool2 = RAGTool(
 print(f"Sources: {tool2.get_sources()}")
 print("--------------------------")
 
+# Load the Ollama model while the agents are set up, agents with the same model share one client
+LLMRegistry.warm_up("llama3.1")
+
 # Initialize and set up Agents
 agent1 = Agent(name="agent1", provider="Ollama", model="llama3.1", tool=tool1)
 agent2 = Agent(name="agent2", provider="Ollama", model="llama3.1", tool=tool2)
 agent3 = Agent(name="agent3", provider="ChatGroq", model="llama3-8b-8192", api_key=groq_api_key)
 
-print()
-print()
-print("--------------------------")
-print(f"Agent 1")
-print("--------------------------")
+# Agent 1 and Agent 2 are independent and run concurrently, Agent 3 gets both results as context
 agent1_query = "Wie teuer ist das Produkt und welche Features hat es?"
-print(f"Query: {agent1_query}")
-agent1_result = agent1.query(agent1_query)
-print(f"Result: {agent1_result}")
-print("--------------------------")
-print(f"Status: {json.dumps(agent1.get_status(), indent=4)}")
-print("--------------------------")
-
-
-print()
-print()
-print("--------------------------")
-print(f"Agent 2")
-print("--------------------------")
 agent2_query = "What is the price of this product and summarize its features?"
-print(f"Query: {agent2_query}")
-agent2_result = agent2.query(agent2_query)
-print(f"Result: {agent2_result}")
-print("--------------------------")
-print(f"Status: {json.dumps(agent2.get_status(), indent=4)}")
-print("--------------------------")
+agent3_query = "Based on the output from Agent1 and Agent2, name the cheaper product and summarize its features."
+pipeline = Pipeline()
+pipeline.add("Agent 1", agent1, agent1_query)
+pipeline.add("Agent 2", agent2, agent2_query)
+pipeline.add("Agent 3", agent3, agent3_query, inputs=["Agent 1", "Agent 2"])
+results = pipeline.run()
 
+for name, agent in [("Agent 1", agent1), ("Agent 2", agent2), ("Agent 3", agent3)]:
+    print()
+    print()
+    print("--------------------------")
+    print(name)
+    print("--------------------------")
+    print(f"Query: {pipeline.nodes[name]['question']}")
+    print(f"Result: {results[name]}")
+    print(f"Time: {pipeline.timings[name]:.1f}s")
+    print("--------------------------")
+    print(f"Status: {json.dumps(agent.get_status(), indent=4)}")
+    print("--------------------------")
 
-print()
-print()
-print("--------------------------")
-print(f"Agent 3")
-print("--------------------------")
-agent3_query = "Based on the output from Agent1 and Agent2, name the cheaper product and summarize its features."
-print(f"Query: {agent3_query}")
-context = f"Agent 1 Result: {agent1_result}\n\nAgent 2 Result: {agent2_result}"
-agent3_result = agent3.query(agent3_query, context)
-print(f"Result: {agent3_result}")
-print("--------------------------")
-print(f"Status: {json.dumps(agent3.get_status(), indent=4)}")
-print("--------------------------")
\ No newline at end of file
+print(f"Total time: {pipeline.timings['total']:.1f}s")
@@ -1,5 +1,21 @@
-from .agent import Agent
-from .ragtool import RAGTool
-from .webtool import WebTool
+from importlib import import_module
 
-__all__ = ['Agent', 'RAGTool', 'WebTool']
\ No newline at end of file
+# Classes are imported on first access, so importing one submodule (e.g. nodeAI.utils.tool) does not
+# require the dependencies of all others (langchain_groq, bs4, sentence_transformers)
+_MODULES = {
+    'Agent': 'agent',
+    'RAGTool': 'ragtool',
+    'WebTool': 'webtool',
+    'Pipeline': 'pipeline',
+    'ResponseCache': 'response_cache',
+    'LLMRegistry': 'llm_registry',
+    'SharedIndex': 'shared_index',
+    'CrossEncoderReranker': 'reranker',
+}
+
+__all__ = ['Agent', 'RAGTool', 'WebTool', 'Pipeline', 'ResponseCache', 'LLMRegistry', 'SharedIndex', 'CrossEncoderReranker']
+
+def __getattr__(name):
+    if name not in _MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(import_module(f".{_MODULES[name]}", __name__), name)
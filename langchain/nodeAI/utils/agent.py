@@ -1,41 +1,85 @@
+import time
 import requests
-from langchain_community.llms import Ollama
-from langchain_groq import ChatGroq
 from langchain.chains import RetrievalQA
+from langchain_core.prompts import format_document
 
 from .ragtool import RAGTool
+from .response_cache import ResponseCache
+from .history import AgentHistory
+from .llm_registry import LLMRegistry
+from .reranker import CrossEncoderReranker, RerankingRetriever
+
+def format_stuff_prompt(chain, documents, question):
+    """
+    Build the prompt a RetrievalQA 'stuff' chain would send to its LLM for the given documents.
+
+    :param chain: RetrievalQA chain.
+    :param documents: Retrieved documents.
+    :param question: The question.
+    :return: PromptValue to be passed to the LLM.
+    """
+    combine_chain = chain.combine_documents_chain
+    context = combine_chain.document_separator.join(
+        format_document(document, combine_chain.document_prompt) for document in documents
+    )
+    return combine_chain.llm_chain.prompt.format_prompt(context=context, question=question)
 
 class Agent:
-    def __init__(self, name: str, provider: str,model: str, api_key: str = None, tool: RAGTool = None):
+    def __init__(self, name: str, provider: str,model: str, api_key: str = None, tool: RAGTool = None, cache: ResponseCache = None,
+                 history_size: int = 100, history_file: str = None, base_url: str = None,
+                 reranker: CrossEncoderReranker = None, fetch_k: int = 20):
         """
         Initialize the Agent class with a specific model and optionally with RAGTool for document processing.
         
         :param model: The model name for the language model (e.g., 'Ollama', 'ChatGroq').
         :param api_key: Optional API key for models requiring authentication (e.g., ChatGroq).
         :param rag_tool: An optional RAGTool instance for document processing.
+        :param cache: An optional ResponseCache, answers to repeated questions are served from it.
+        :param history_size: Number of queries kept in the history.
+        :param history_file: Optional JSONL file older history entries are appended to.
+        :param base_url: Optional server URL of the provider (e.g. a remote Ollama server).
+        :param reranker: Optional CrossEncoderReranker, fetch_k candidates are retrieved and only its top_n are passed to the LLM.
+        :param fetch_k: Number of candidates retrieved for the reranker.
         """
         self.configuration = {}
         self.configuration['agent_name'] = name
         self.configuration['provider'] = provider
         self.configuration['model_name'] = model
         self.configuration['api_key'] = api_key
+        self.configuration['base_url'] = base_url
         self.configuration['tool'] = tool
+        self.configuration['reranker'] = reranker
+        self.configuration['fetch_k'] = fetch_k
 
         self.input = ""
         self.context = ""
         self.output = ""
         self.chain = None
-        self.history = {}  # Store results of previous queries
+        self.llm = None
+        self.retriever = None
+        self.history = AgentHistory(history_size, history_file)  # Store results of previous queries
+        self.cache = cache
 
         self.setup_chain()
     
-    def get_status(self):
+    def get_status(self, offset: int = 0, limit: int = 10):
+        """
+        Get the current state of the agent and a page of its history.
+
+        :param offset: Number of newest history entries to skip.
+        :param limit: Maximum number of history entries returned.
+        :return: Status dict.
+        """
         status = {}
         print(self.input)
         status['input'] = self.input
         status['context'] = self.context
         status['output'] = self.output
-        status['history'] = self.history    
+        status['history'] = self.history.page(offset, limit)
+        if self.cache:
+            status['cache'] = self.cache.get_status()
+        if self.configuration['reranker']:
+            status['reranker'] = self.configuration['reranker'].get_status()
         return status
 
     def setup_chain(self):
@@ -43,30 +87,21 @@ class Agent:
         Set up the retrieval chain using the document retriever from RAGTool if provided.
         """
         try:
-            if self.configuration['provider'] == 'Ollama':
-                llm = Ollama(model=self.configuration['model_name'])
-                if self.configuration['tool']:
-                    retriever = self.configuration['tool'].get_document_retriever()
-                    self.chain = RetrievalQA.from_chain_type(llm, retriever=retriever)
-                else:
-                    retriever = None
-                    self.chain = llm
-            elif self.configuration['provider'] == 'ChatGroq':
-                #if not self.check_online_access():
-                #    raise RuntimeError("ChatGroq is not accessible offline.")
-                if not self.configuration['api_key']:
-                    raise ValueError("API key is required for ChatGroq.")
-                # Initialize ChatGroq specific setup here
-                llm = ChatGroq(model=self.configuration['model_name'], api_key=self.configuration['api_key'])
-
-                if self.configuration['tool']:
-                    retriever = self.configuration['tool'].get_document_retriever()
-                    self.chain = RetrievalQA.from_chain_type(llm, retriever=retriever)
-                else:
-                    retriever = None
-                    self.chain = llm
+            # Agents with the same provider, model, server and credentials share one client
+            llm = LLMRegistry.get(self.configuration['provider'], self.configuration['model_name'],
+                                  api_key=self.configuration['api_key'], base_url=self.configuration['base_url'])
+            if self.configuration['tool'] and self.configuration['reranker']:
+                # Over-fetch candidates, the reranker keeps the best ones for the prompt
+                retriever = RerankingRetriever(retriever=self.configuration['tool'].get_document_retriever(k=self.configuration['fetch_k']),
+                                               reranker=self.configuration['reranker'])
+                self.chain = RetrievalQA.from_chain_type(llm, retriever=retriever)
+            elif self.configuration['tool']:
+                retriever = self.configuration['tool'].get_document_retriever()
+                self.chain = RetrievalQA.from_chain_type(llm, retriever=retriever)
             else:
-                raise ValueError(f"Unsupported model: {self.configuration['provider']}")
+                retriever = None
+                self.chain = llm
+            self.llm, self.retriever = llm, retriever
         except Exception as e:
             print(f"Error during setup_chain: {e}")
             raise
@@ -101,6 +136,11 @@ class Agent:
         #final_query = f"{context}\n\n{question}" if context else question
         self.input = f"Context: {self.context}\nQuestion: {self.input}"  if self.context else f"Question: {self.input}"
 
+        cached, scope_key = self._cached_answer(question, context, self.input)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
         try:
             if self.configuration['provider'] == 'Ollama':
                 # For direct LLM query without retrieval
@@ -114,10 +154,171 @@ class Agent:
                 self.output = self.chain.invoke(self.input)  # Direct string query for RetrievalQA
             
             # Store the result of the query
-            self.history[self.input] = self.output['result'] if isinstance(self.output, dict) else self.output
+            result = self.output['result'] if isinstance(self.output, dict) else self.output
+            self._store_answer(question, context, self.input, result, time.perf_counter() - start, scope_key)
 
-            return self.output['result'] if isinstance(self.output, dict) else self.output
+            return result
         
         except Exception as e:
             print(f"Error during query: {e}")
             return None
+
+    def query_batch(self, questions: list, context: str = None, k: int = 4, max_concurrency: int = 4):
+        """
+        Query the model with many questions at once.
+
+        With a tool, all questions are embedded in one batch and retrieved with one FAISS search.
+        The LLM calls are dispatched with bounded concurrency. Answers from the response cache are
+        not sent to the LLM again.
+
+        :param questions: List of questions.
+        :param context: Optional context included in every question.
+        :param k: Number of documents retrieved per question. With a reranker fetch_k documents are retrieved and
+                  the reranker's top_n are kept, like in query().
+        :param max_concurrency: Maximum number of LLM calls running at the same time.
+        :return: List of dicts with question, result and error (None on success), in the order of the questions.
+        """
+        if not self.chain:
+            raise RuntimeError("Chain not set up. Please call setup_chain() before querying.")
+
+        tool = self.configuration['tool']
+        inputs = [f"Context: {context}\nQuestion: {question}" if context else f"Question: {question}" for question in questions]
+        results = [{'question': question, 'result': None, 'error': None} for question in questions]
+
+        pending = []
+        for i, input in enumerate(inputs):
+            if self.cache:
+                scope, key = self.cache.make_key(self.configuration['provider'], self.configuration['model_name'],
+                                                 tool.get_fingerprint() if tool else None, input)
+                cached = self.cache.get(scope, key, input)
+                if cached is not None:
+                    results[i]['result'] = cached
+                    self.history.add(questions[i], context, cached, 0.0, cached=True)
+                    continue
+            pending.append(i)
+        if not pending:
+            return results
+
+        start = time.perf_counter()
+        config = {'max_concurrency': max_concurrency}
+        try:
+            if tool:
+                reranker = self.configuration['reranker']
+                if reranker:
+                    # All (question, chunk) pairs are scored in one batch
+                    documents = reranker.rerank_batch([inputs[i] for i in pending],
+                                                      tool.search_batch([inputs[i] for i in pending], self.configuration['fetch_k']))
+                else:
+                    documents = tool.search_batch([inputs[i] for i in pending], k)
+                outputs = self.chain.combine_documents_chain.batch(
+                    [{'input_documents': docs, 'question': inputs[i]} for i, docs in zip(pending, documents)],
+                    config=config, return_exceptions=True
+                )
+            else:
+                outputs = self.chain.batch([inputs[i] for i in pending], config=config, return_exceptions=True)
+        except Exception as e:
+            print(f"Error during query_batch: {e}")
+            outputs = [e] * len(pending)
+        seconds = (time.perf_counter() - start) / len(pending)
+
+        for i, output in zip(pending, outputs):
+            if isinstance(output, Exception):
+                results[i]['error'] = str(output)
+                continue
+            if isinstance(output, dict):
+                output = output.get('output_text', output.get('result'))
+            result = getattr(output, 'content', output)
+            results[i]['result'] = result
+            self.history.add(questions[i], context, result, seconds)
+            if self.cache:
+                scope, key = self.cache.make_key(self.configuration['provider'], self.configuration['model_name'],
+                                                 tool.get_fingerprint() if tool else None, inputs[i])
+                self.cache.put(scope, key, inputs[i], result, seconds)
+        return results
+
+    def _cached_answer(self, question, context, input):
+        if not self.cache:
+            return None, None
+        tool = self.configuration['tool']
+        scope_key = self.cache.make_key(self.configuration['provider'], self.configuration['model_name'],
+                                        tool.get_fingerprint() if tool else None, input)
+        cached = self.cache.get(*scope_key, input)
+        if cached is not None:
+            self.output = cached
+            self.history.add(question, context, cached, 0.0, cached=True)
+        return cached, scope_key
+
+    def _store_answer(self, question, context, input, result, seconds, scope_key):
+        self.output = result
+        self.history.add(question, context, result, seconds)
+        if self.cache:
+            self.cache.put(*scope_key, input, result, seconds)
+
+    def stream_query(self, question: str, context: str = None):
+        """
+        Query the model and yield the answer while it is generated.
+
+        With a tool the retrieved documents are yielded first, so a caller can show the sources
+        before the LLM produces its first token.
+
+        :param question: The question to be asked.
+        :param context: Optional context to be included in the query.
+        :return: Generator of dicts {'type': 'sources', 'documents': [...]} and {'type': 'token', 'content': str}.
+        """
+        if not self.chain:
+            raise RuntimeError("Chain not set up. Please call setup_chain() before querying.")
+
+        self.context = context
+        self.input = f"Context: {context}\nQuestion: {question}" if context else f"Question: {question}"
+        cached, scope_key = self._cached_answer(question, context, self.input)
+        if cached is not None:
+            yield {'type': 'token', 'content': cached}
+            return
+
+        start = time.perf_counter()
+        if self.retriever:
+            documents = self.retriever.invoke(self.input)
+            yield {'type': 'sources', 'documents': documents}
+            prompt = format_stuff_prompt(self.chain, documents, self.input)
+        else:
+            prompt = self.input
+
+        result = ""
+        for chunk in self.llm.stream(prompt):
+            token = getattr(chunk, 'content', chunk)
+            result += token
+            yield {'type': 'token', 'content': token}
+        self._store_answer(question, context, self.input, result, time.perf_counter() - start, scope_key)
+
+    async def astream_query(self, question: str, context: str = None):
+        """
+        Async variant of stream_query.
+
+        :param question: The question to be asked.
+        :param context: Optional context to be included in the query.
+        :return: Async generator of the same dicts as stream_query.
+        """
+        if not self.chain:
+            raise RuntimeError("Chain not set up. Please call setup_chain() before querying.")
+
+        self.context = context
+        self.input = f"Context: {context}\nQuestion: {question}" if context else f"Question: {question}"
+        cached, scope_key = self._cached_answer(question, context, self.input)
+        if cached is not None:
+            yield {'type': 'token', 'content': cached}
+            return
+
+        start = time.perf_counter()
+        if self.retriever:
+            documents = await self.retriever.ainvoke(self.input)
+            yield {'type': 'sources', 'documents': documents}
+            prompt = format_stuff_prompt(self.chain, documents, self.input)
+        else:
+            prompt = self.input
+
+        result = ""
+        async for chunk in self.llm.astream(prompt):
+            token = getattr(chunk, 'content', chunk)
+            result += token
+            yield {'type': 'token', 'content': token}
+        self._store_answer(question, context, self.input, result, time.perf_counter() - start, scope_key)
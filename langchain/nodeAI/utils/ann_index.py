@@ -0,0 +1,397 @@
+import os
+import time
+import tempfile
+import threading
+import faiss
+import numpy as np
+
+from .embedding_cache import CachedEmbeddings
+
+INDEX_TYPES = ('flat', 'ivf', 'hnsw', 'pq', 'fp16', 'int8')
+# Index types which store the vectors lossy, see rerank_positions
+COMPRESSED_INDEX_TYPES = ('pq', 'fp16', 'int8')
+
+class ExactVectors:
+    """
+    Exact float32 vectors of a FAISS index, stored in a file addressed by index position.
+
+    Kept next to a compressed index, so re-ranking and index conversion read the original vectors
+    instead of embedding the chunks again. The file is memory-mapped, only the rows read are paged
+    in. Removals shift the later rows down like FAISS removes vectors from flat and scalar
+    quantised indexes, so row i always holds the vector at index position i.
+    """
+    def __init__(self, path: str = None, dim: int = None):
+        """
+        :param path: File of the vectors, an existing file is reopened. Without a path the vectors
+                     are kept in an anonymous temporary file which is deleted when it is closed.
+        :param dim: Dimension of the vectors, required to reopen an existing file.
+        """
+        self.path = path
+        self.dim = dim
+        if path:
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+            self.file = open(path, 'r+b')
+        else:
+            self.file = tempfile.TemporaryFile()
+        self._data = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        if not self.dim:
+            return 0
+        return os.fstat(self.file.fileno()).st_size // (4 * self.dim)
+
+    def _rows(self):
+        if self._data is None and len(self):
+            self._data = np.memmap(self.file, dtype=np.float32, mode='r', shape=(len(self), self.dim))
+        return self._data
+
+    def reset(self, vectors):
+        """
+        Replace all vectors.
+
+        :param vectors: Matrix of vectors in index order.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            self._data = None
+            self.dim = vectors.shape[1]
+            self.file.seek(0)
+            self.file.truncate()
+            self.file.write(vectors.tobytes())
+            self.file.flush()
+
+    def append(self, vectors):
+        """
+        Append the vectors of positions added at the end of the index.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Vector dimension {vectors.shape[1]} does not match the stored dimension {self.dim}.")
+            self._data = None
+            self.file.seek(0, os.SEEK_END)
+            self.file.write(vectors.tobytes())
+            self.file.flush()
+
+    def delete(self, positions, block: int = 65536):
+        """
+        Remove the vectors of the given positions, the following vectors move down.
+
+        The file is compacted in place, block by block.
+        """
+        with self._lock:
+            count = len(self)
+            keep = np.ones(count, dtype=bool)
+            keep[np.asarray(list(positions), dtype=np.int64)] = False
+            removed = np.flatnonzero(~keep)
+            if not len(removed):
+                return
+            rows = self._rows()
+            write = int(removed[0])
+            for start in range(write, count, block):
+                kept = np.array(rows[start:start + block][keep[start:start + block]])
+                self.file.seek(write * 4 * self.dim)
+                self.file.write(kept.tobytes())
+                write += len(kept)
+            self._data = rows = None
+            self.file.truncate(write * 4 * self.dim)
+            self.file.flush()
+
+    def get(self, positions):
+        """
+        Get the vectors of the given positions.
+
+        :return: Matrix of vectors in the order of the positions.
+        """
+        with self._lock:
+            return np.array(self._rows()[np.asarray(positions, dtype=np.int64)])
+
+    def read(self):
+        """
+        Get all vectors in index order.
+        """
+        with self._lock:
+            rows = self._rows()
+            return np.zeros((0, self.dim or 0), dtype=np.float32) if rows is None else np.array(rows)
+
+    def close(self):
+        with self._lock:
+            self._data = None
+            self.file.close()
+
+def keeps_exact_vectors(index_type: str):
+    """
+    Check if ExactVectors are needed for an index type: compressed indexes do not hold the exact
+    vectors and 'auto' may choose one.
+    """
+    return index_type in COMPRESSED_INDEX_TYPES or index_type == 'auto'
+
+def choose_index_type(ntotal: int):
+    """
+    Choose an index type for the number of indexed vectors.
+
+    Small corpora are searched exactly, HNSW is used up to a few hundred thousand vectors,
+    IVF beyond that and IVF with product quantisation for millions of vectors.
+
+    :param ntotal: Number of vectors.
+    :return: Index type.
+    """
+    if ntotal < 10000:
+        return 'flat'
+    if ntotal < 200000:
+        return 'hnsw'
+    if ntotal < 2000000:
+        return 'ivf'
+    return 'pq'
+
+def get_index_type(index):
+    """
+    Get the type of a FAISS index as used by build_index.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return 'pq'
+    if isinstance(index, faiss.IndexIVFFlat):
+        return 'ivf'
+    if isinstance(index, faiss.IndexHNSWFlat):
+        return 'hnsw'
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return {faiss.ScalarQuantizer.QT_fp16: 'fp16', faiss.ScalarQuantizer.QT_8bit: 'int8'}.get(index.sq.qtype, 'sq')
+    if isinstance(index, faiss.IndexFlat):
+        return 'flat'
+    return type(index).__name__
+
+def _pq_subquantizers(dimension):
+    # About 8 dimensions per sub-quantizer, the number must divide the dimension
+    for m in range(max(1, dimension // 8), 0, -1):
+        if dimension % m == 0:
+            return m
+    return 1
+
+def build_index(index_type: str, vectors, params: dict = None):
+    """
+    Build and fill a FAISS index of the given type (L2 distance, like the default LangChain index).
+
+    IVF, PQ and int8 indexes are trained on the given vectors; if there are too few vectors to train
+    IVF or PQ a flat index is built instead.
+
+    :param index_type: 'flat', 'ivf', 'hnsw', 'pq' (IVF with product quantisation), 'fp16' or 'int8' (scalar quantised, 2 or 1 bytes per dimension).
+    :param vectors: Matrix of vectors (n x dimension).
+    :param params: Optional settings: nlist, nprobe (IVF/PQ), pq_m (PQ), M, ef_construction, ef_search (HNSW).
+    :return: FAISS index.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unsupported index type: {index_type}")
+    params = params or {}
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dimension = vectors.shape
+
+    if index_type in ('ivf', 'pq'):
+        # FAISS needs about 39 training vectors per centroid and 256 per PQ code book
+        nlist = min(params.get('nlist') or int(4 * np.sqrt(n)), n // 39)
+        if nlist < 1 or (index_type == 'pq' and n < 256):
+            index_type = 'flat'
+        else:
+            quantizer = faiss.IndexFlatL2(dimension)
+            if index_type == 'ivf':
+                index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+            else:
+                index = faiss.IndexIVFPQ(quantizer, dimension, nlist, params.get('pq_m') or _pq_subquantizers(dimension), 8)
+            index.train(vectors)
+            index.nprobe = params.get('nprobe') or max(1, nlist // 8)
+
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dimension, params.get('M', 32))
+        index.hnsw.efConstruction = params.get('ef_construction', 80)
+        index.hnsw.efSearch = params.get('ef_search', 64)
+    elif index_type in ('fp16', 'int8'):
+        qtype = faiss.ScalarQuantizer.QT_fp16 if index_type == 'fp16' else faiss.ScalarQuantizer.QT_8bit
+        index = faiss.IndexScalarQuantizer(dimension, qtype, faiss.METRIC_L2)
+        # Learns the value range of each dimension for int8
+        index.train(vectors)
+    elif index_type == 'flat':
+        index = faiss.IndexFlatL2(dimension)
+
+    index.add(vectors)
+    return index
+
+def supports_remove(index):
+    """
+    Check if vectors can be removed from the index the way the FAISS vector store expects.
+
+    HNSW graphs do not support removal and IVF indexes do not renumber the remaining vectors.
+    """
+    return get_index_type(index) in ('flat', 'fp16', 'int8')
+
+def get_memory_bytes(index):
+    """
+    Get the size of a FAISS index in bytes (size of its serialised form).
+    """
+    return faiss.serialize_index(index).nbytes
+
+def rerank_positions(exact_vectors: ExactVectors, query_vectors, candidates, k: int):
+    """
+    Re-rank candidate positions of a compressed index by the exact distance to the queries.
+
+    :param exact_vectors: ExactVectors of the index.
+    :param query_vectors: Matrix of query vectors.
+    :param candidates: Matrix of candidate positions per query (-1 for missing results).
+    :param k: Number of positions kept per query.
+    :return: List of position lists, nearest first.
+    """
+    positions = sorted({int(i) for row in candidates for i in row if i != -1})
+    if not positions:
+        return [[] for _ in candidates]
+    exact = dict(zip(positions, exact_vectors.get(positions)))
+    results = []
+    for query, row in zip(query_vectors, candidates):
+        row = [int(i) for i in row if i != -1]
+        distances = [float(np.sum((exact[i] - query) ** 2)) for i in row]
+        results.append([row[j] for j in np.argsort(distances)[:k]])
+    return results
+
+def get_vectors(db, embeddings, exact_vectors: ExactVectors = None):
+    """
+    Get the vectors of a FAISS vector store in index order.
+
+    Vectors are reconstructed from indexes which store them exactly; for compressed indexes they
+    are read from exact_vectors. Only without exact_vectors (e.g. an index saved before they were
+    kept) the docstore texts are embedded again.
+
+    :param db: FAISS vector store.
+    :param embeddings: Embedding model of the vector store.
+    :param exact_vectors: Optional ExactVectors of the index.
+    :return: Matrix of vectors (ntotal x dimension).
+    """
+    index = faiss.downcast_index(db.index)
+    index_type = get_index_type(index)
+    if index_type in ('flat', 'hnsw'):
+        return index.reconstruct_n(0, index.ntotal)
+    if index_type == 'ivf':
+        index.make_direct_map()
+        vectors = index.reconstruct_n(0, index.ntotal)
+        index.make_direct_map(False)
+        return vectors
+    if exact_vectors is not None and len(exact_vectors) == index.ntotal:
+        return exact_vectors.read()
+    texts = [db.docstore.search(db.index_to_docstore_id[i]).page_content for i in range(index.ntotal)]
+    return np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+
+def convert_index(db, embeddings, index_type: str, params: dict = None, exact_vectors: ExactVectors = None):
+    """
+    Replace the index of a FAISS vector store by an index of the given type.
+
+    The docstore and the mapping of index positions to ids stay valid, vectors added later go
+    into the new index (IVF and PQ keep the centroids trained at conversion).
+
+    :param db: FAISS vector store.
+    :param embeddings: Embedding model of the vector store.
+    :param index_type: One of INDEX_TYPES or 'auto' to choose by the number of vectors.
+    :param params: Optional index settings, see build_index.
+    :param exact_vectors: Optional ExactVectors of the index, see get_vectors.
+    :return: Type of the index now used.
+    """
+    if index_type == 'auto':
+        index_type = choose_index_type(db.index.ntotal)
+    if get_index_type(db.index) != index_type:
+        db.index = build_index(index_type, get_vectors(db, embeddings, exact_vectors), params)
+    return get_index_type(db.index)
+
+def embed_queries(embeddings, queries: list):
+    """
+    Embed search queries in one batch with the query encode settings of the model.
+
+    Queries bypass an embedding cache (CachedEmbeddings caches only documents), so they neither
+    evict chunk vectors nor rewrite the cache index. Models other than HuggingFaceEmbeddings have
+    no batched query embedding and are called once per query.
+
+    :param embeddings: Embedding model, may be wrapped in CachedEmbeddings.
+    :param queries: List of query strings.
+    :return: Matrix of query vectors.
+    """
+    if isinstance(embeddings, CachedEmbeddings):
+        embeddings = embeddings.embeddings
+    if hasattr(embeddings, '_embed') and hasattr(embeddings, 'query_encode_kwargs'):
+        # Same settings as HuggingFaceEmbeddings.embed_query, in a single encode call
+        encode_kwargs = embeddings.query_encode_kwargs or embeddings.encode_kwargs
+        vectors = embeddings._embed(list(queries), encode_kwargs)
+    else:
+        vectors = [embeddings.embed_query(query) for query in queries]
+    return np.asarray(vectors, dtype=np.float32).reshape(len(queries), -1)
+
+def _search_each(index, queries, k, fetch_k=None, rerank=None):
+    """
+    Search the queries one by one and measure the latency of each search.
+
+    :param fetch_k: Number of candidates fetched per query, defaults to k.
+    :param rerank: Optional function (queries, candidates, k) returning the re-ranked positions.
+    """
+    results, latencies = [], []
+    for query in queries:
+        query = query.reshape(1, -1)
+        start = time.perf_counter()
+        _, indices = index.search(query, fetch_k or k)
+        if rerank:
+            indices = rerank(query, indices, k)
+        latencies.append(time.perf_counter() - start)
+        results.append(indices[0])
+    return results, np.array(latencies) * 1000
+
+def evaluate_index(db, embeddings, queries: list = None, k: int = 4, sample: int = 100, rerank: int = 0,
+                   exact_vectors: ExactVectors = None):
+    """
+    Compare the index of a FAISS vector store with an exact flat index.
+
+    :param db: FAISS vector store.
+    :param embeddings: Embedding model of the vector store.
+    :param queries: Optional query strings, by default a sample of the indexed vectors is used.
+    :param k: Number of results per query.
+    :param sample: Number of indexed vectors used as queries if no queries are given.
+    :param rerank: Over-fetch factor, k * rerank candidates of a compressed index are re-ranked exactly.
+    :param exact_vectors: ExactVectors of the index, required for rerank.
+    :return: Dict with index type, recall@k, p50/p99 search latency and memory of the index and of the flat baseline.
+    """
+    vectors = get_vectors(db, embeddings, exact_vectors)
+    if queries:
+        query_vectors = embed_queries(embeddings, queries)
+    else:
+        rows = np.random.default_rng(0).choice(len(vectors), min(sample, len(vectors)), replace=False)
+        query_vectors = vectors[rows]
+
+    flat = build_index('flat', vectors)
+    expected, flat_latencies = _search_each(flat, query_vectors, k)
+    reranking = rerank > 1 and get_index_type(db.index) in COMPRESSED_INDEX_TYPES
+    if reranking:
+        if exact_vectors is None:
+            raise ValueError("Re-ranking needs the exact vectors of the index.")
+        found, latencies = _search_each(db.index, query_vectors, k, k * rerank,
+                                        lambda query, candidates, k: rerank_positions(exact_vectors, query, candidates, k))
+    else:
+        found, latencies = _search_each(db.index, query_vectors, k)
+
+    recalls = []
+    for expected_row, found_row in zip(expected, found):
+        relevant = set(expected_row) - {-1}
+        if relevant:
+            recalls.append(len(relevant & set(found_row)) / len(relevant))
+
+    memory, flat_memory = get_memory_bytes(db.index), get_memory_bytes(flat)
+    return {
+        'index_type': get_index_type(db.index),
+        'ntotal': db.index.ntotal,
+        'queries': len(query_vectors),
+        'k': k,
+        'rerank': rerank if reranking else 0,
+        'recall_at_k': float(np.mean(recalls)) if recalls else 1.0,
+        'latency_p50_ms': float(np.percentile(latencies, 50)),
+        'latency_p99_ms': float(np.percentile(latencies, 99)),
+        'flat_latency_p50_ms': float(np.percentile(flat_latencies, 50)),
+        'flat_latency_p99_ms': float(np.percentile(flat_latencies, 99)),
+        'memory_bytes': memory,
+        'flat_memory_bytes': flat_memory,
+        'memory_saved': 1 - memory / flat_memory
+    }
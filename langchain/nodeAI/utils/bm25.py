@@ -0,0 +1,183 @@
+import re
+import math
+import threading
+from array import array
+from collections import Counter
+
+import numpy as np
+
+# Words, keeping model numbers, prices and versions like 'tl-wr841n', '59,99' or '1.2' as one token
+TOKEN_PATTERN = re.compile(r"\w+(?:[.,/-]\w+)*")
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+class BM25Index:
+    """
+    Incrementally updated inverted index with BM25 scoring.
+
+    Documents are numbered in insertion order, each term keeps the numbers and term frequencies of
+    the documents containing it. Searches score only the postings of the query terms with numpy,
+    so the cost depends on the length of these postings and not on the number of documents.
+    Deleted documents are masked and removed from the postings once they are the majority.
+    """
+    def __init__(self, k1: float = 1.5, b: float = 0.75, max_postings: int = 100000):
+        """
+        :param k1: BM25 term frequency saturation.
+        :param b: BM25 document length normalisation.
+        :param max_postings: Query terms found in more documents are ignored. Such terms are stop words in large
+                             corpora, they contribute little to the score but dominate the search time.
+        """
+        self.k1 = k1
+        self.b = b
+        self.max_postings = max_postings
+        self.ids = []
+        self.numbers = {}
+        self.lengths = array('f')
+        self.alive = bytearray()
+        self.postings = {}
+        self.total_length = 0
+        self.count = 0
+        self._arrays = {}
+        self._lengths = None
+        self._alive = None
+        self._scores = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_arrays'], state['_lengths'], state['_alive'], state['_scores'] = {}, None, None, None
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add(self, ids: list, texts: list):
+        """
+        Add documents.
+
+        :param ids: Docstore ids of the documents.
+        :param texts: Texts of the documents.
+        """
+        with self._lock:
+            self._add(ids, texts)
+
+    def _add(self, ids, texts):
+        for id, text in zip(ids, texts):
+            tokens = tokenize(text)
+            number = len(self.ids)
+            self.ids.append(id)
+            self.numbers[id] = number
+            self.lengths.append(len(tokens))
+            self.alive.append(1)
+            self.total_length += len(tokens)
+            self.count += 1
+            for term, frequency in Counter(tokens).items():
+                documents, frequencies = self.postings.setdefault(term, (array('I'), array('f')))
+                documents.append(number)
+                frequencies.append(frequency)
+                self._arrays.pop(term, None)
+        self._lengths = self._alive = self._scores = None
+
+    def delete(self, ids: list):
+        """
+        Delete documents by their docstore ids, unknown ids are ignored.
+        """
+        with self._lock:
+            self._delete(ids)
+
+    def _delete(self, ids):
+        for id in ids:
+            number = self.numbers.pop(id, None)
+            if number is None:
+                continue
+            self.alive[number] = 0
+            self.total_length -= self.lengths[number]
+            self.count -= 1
+        self._alive = None
+        if self.count < len(self.ids) / 2:
+            self._compact()
+
+    def _compact(self):
+        """
+        Drop deleted documents from the postings and renumber the remaining documents.
+        """
+        alive = np.frombuffer(bytes(self.alive), dtype=np.uint8).astype(bool)
+        renumber = np.cumsum(alive) - 1
+        postings = {}
+        for term, (documents, frequencies) in self.postings.items():
+            documents, frequencies = np.array(documents), np.array(frequencies)
+            keep = alive[documents]
+            if keep.any():
+                postings[term] = (array('I', renumber[documents[keep]].tolist()), array('f', frequencies[keep].tolist()))
+        self.postings = postings
+        self.ids = [id for id, keep in zip(self.ids, alive) if keep]
+        self.numbers = {id: number for number, id in enumerate(self.ids)}
+        self.lengths = array('f', np.array(self.lengths)[alive].tolist())
+        self.alive = bytearray(b"\x01" * len(self.ids))
+        self._arrays, self._lengths, self._alive, self._scores = {}, None, None, None
+
+    def _get_postings(self, term):
+        if term not in self._arrays:
+            documents, frequencies = self.postings[term]
+            self._arrays[term] = (np.array(documents, dtype=np.int64), np.array(frequencies, dtype=np.float32))
+        return self._arrays[term]
+
+    def search(self, query: str, k: int = 4):
+        """
+        Get the best matching documents of a query.
+
+        :param query: Query text.
+        :param k: Maximum number of documents.
+        :return: List of (docstore id, score), best first. Documents without any query term are not returned.
+        """
+        with self._lock:
+            terms = [term for term in set(tokenize(query)) if term in self.postings and len(self.postings[term][0]) <= self.max_postings]
+            if not terms or not self.count:
+                return []
+            if self._lengths is None:
+                self._lengths = np.array(self.lengths, dtype=np.float32)
+                self._scores = np.zeros(len(self._lengths), dtype=np.float32)
+            if self._alive is None:
+                self._alive = np.frombuffer(bytes(self.alive), dtype=np.uint8).astype(bool)
+            average_length = self.total_length / self.count
+
+            # Accumulate the scores of the documents in the postings of the query terms
+            candidates = []
+            for term in terms:
+                documents, frequencies = self._get_postings(term)
+                idf = math.log(1 + (self.count - len(documents) + 0.5) / (len(documents) + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[documents] / average_length)
+                self._scores[documents] += idf * frequencies * (self.k1 + 1) / (frequencies + norm)
+                candidates.append(documents)
+            candidates = np.concatenate(candidates)
+            scores = self._scores[candidates] * self._alive[candidates]
+            self._scores[candidates] = 0
+
+        # A document is listed once per matching term, k * terms entries hold at least k distinct documents
+        limit = k * len(terms)
+        top = np.argpartition(-scores, limit)[:limit] if len(scores) > limit else np.arange(len(scores))
+        results = {}
+        for i in top[np.argsort(-scores[top])]:
+            if scores[i] > 0:
+                results.setdefault(int(candidates[i]), float(scores[i]))
+        return [(self.ids[number], score) for number, score in list(results.items())[:k]]
+
+    def __len__(self):
+        return self.count
+
+def reciprocal_rank_fusion(rankings: list, k: int = 60):
+    """
+    Fuse rankings with reciprocal rank fusion, every ranking adds 1 / (k + rank) to the score of its ids.
+
+    :param rankings: Lists of ids, best first.
+    :param k: Damping constant, higher values give lower ranks more weight.
+    :return: List of ids, best first. Ties keep the order of the earlier rankings.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, id in enumerate(ranking, start=1):
+            scores[id] = scores.get(id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -0,0 +1,211 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+class EmbeddingCache:
+    """
+    Content-addressed, size-bounded store for embedding vectors.
+
+    Vectors are kept in a fixed-size float32 file that is memory-mapped, the mapping from key
+    to slot is kept in a small JSON index in least-recently-used order. When the cache is full
+    the least recently used slot is overwritten. A digest of the key is stored next to each slot
+    and checked on lookup, so an index written before a slot was reused never returns the wrong vector.
+
+    Use EmbeddingCache.open() to get the cache of a directory, all users of a directory must
+    share one instance: every instance keeps its own slot allocation and index.
+    A cache holds vectors of one dimension, models with other dimensions need their own directory.
+    """
+    _lock_registry = threading.Lock()
+    _instances = {}
+
+    @classmethod
+    def open(cls, directory: str, capacity: int = 100000):
+        """
+        Get the shared cache of a directory, creating it on first use.
+
+        :param directory: Directory holding the vector file and the index.
+        :param capacity: Maximum number of vectors, only used when the cache is created.
+        :return: EmbeddingCache instance.
+        """
+        key = os.path.realpath(directory)
+        with cls._lock_registry:
+            if key not in cls._instances:
+                cls._instances[key] = cls(directory, capacity)
+            return cls._instances[key]
+
+    def __init__(self, directory: str, capacity: int = 100000):
+        """
+        Open (or create) an embedding cache in a directory.
+
+        :param directory: Directory holding the vector file and the index.
+        :param capacity: Maximum number of vectors kept in the cache.
+        """
+        self.directory = directory
+        self.capacity = capacity
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.index_path = os.path.join(directory, "index.json")
+        self.keys_path = os.path.join(directory, "keys.bin")
+        self.dim = None
+        self.vectors = None
+        self.slot_keys = None
+        self.entries = OrderedDict()
+        self.next_slot = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+
+    def _open(self):
+        if not os.path.exists(self.index_path) or not os.path.exists(self.vectors_path):
+            return
+        with open(self.index_path, 'r') as f:
+            index = json.load(f)
+        self.dim = index['dim']
+        self.capacity = index['capacity']
+        self.next_slot = index['next_slot']
+        self.entries = OrderedDict((key, slot) for key, slot in index['entries'])
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(self.capacity, self.dim))
+        if os.path.exists(self.keys_path):
+            self.slot_keys = np.memmap(self.keys_path, dtype=np.uint8, mode='r+', shape=(self.capacity, 16))
+        else:
+            # Cache written before the key digests were stored, take them from the index
+            self.slot_keys = np.memmap(self.keys_path, dtype=np.uint8, mode='w+', shape=(self.capacity, 16))
+            for key, slot in self.entries.items():
+                self.slot_keys[slot] = self._digest(key)
+
+    def _create(self, dim):
+        self.dim = dim
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='w+', shape=(self.capacity, self.dim))
+        self.slot_keys = np.memmap(self.keys_path, dtype=np.uint8, mode='w+', shape=(self.capacity, 16))
+
+    @staticmethod
+    def _digest(key):
+        return np.frombuffer(hashlib.sha256(key.encode('utf-8')).digest()[:16], dtype=np.uint8)
+
+    def get(self, keys):
+        """
+        Look up vectors for a list of keys.
+
+        :param keys: List of cache keys.
+        :return: List with a vector (list of floats) for each hit and None for each miss.
+        """
+        results = []
+        with self._lock:
+            for key in keys:
+                slot = self.entries.get(key)
+                if slot is not None and not np.array_equal(self.slot_keys[slot], self._digest(key)):
+                    # The slot was reused for another key after the index was written
+                    del self.entries[key]
+                    slot = None
+                if slot is None:
+                    self.misses += 1
+                    results.append(None)
+                else:
+                    self.hits += 1
+                    self.entries.move_to_end(key)
+                    results.append(self.vectors[slot].tolist())
+        return results
+
+    def put(self, keys, vectors):
+        """
+        Store vectors, evicting the least recently used entries when the cache is full.
+
+        :param keys: List of cache keys.
+        :param vectors: List of vectors, one per key.
+        """
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                if self.vectors is None:
+                    self._create(len(vector))
+                elif len(vector) != self.dim:
+                    raise ValueError(f"Embedding cache {self.directory} holds vectors of dimension {self.dim}, got {len(vector)}. "
+                                     "Use a separate cache directory for models with another dimension.")
+                slot = self.entries.get(key)
+                if slot is None:
+                    if self.next_slot < self.capacity:
+                        slot = self.next_slot
+                        self.next_slot += 1
+                    else:
+                        _, slot = self.entries.popitem(last=False)
+                self.vectors[slot] = np.asarray(vector, dtype=np.float32)
+                self.slot_keys[slot] = self._digest(key)
+                self.entries[key] = slot
+                self.entries.move_to_end(key)
+
+    def flush(self):
+        """
+        Write the vector file and the index to disk.
+        """
+        with self._lock:
+            if self.vectors is None:
+                return
+            self.vectors.flush()
+            self.slot_keys.flush()
+            index = {
+                'dim': self.dim,
+                'capacity': self.capacity,
+                'next_slot': self.next_slot,
+                'entries': list(self.entries.items())
+            }
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f, separators=(',', ':'))
+            os.replace(tmp_path, self.index_path)
+
+    def get_status(self):
+        return {'entries': len(self.entries), 'capacity': self.capacity, 'hits': self.hits, 'misses': self.misses}
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that consults an EmbeddingCache before calling the embedding model.
+
+    Keys are the hash of the embedding model id and the chunk text, so a cache directory can be
+    shared by tools using different models of the same dimension.
+    The index is written every flush_every new vectors; call flush() once an ingestion is done.
+    """
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model_id: str = None, flush_every: int = 10000):
+        """
+        :param embeddings: The underlying embedding model.
+        :param cache: The EmbeddingCache to use.
+        :param model_id: Identifier of the embedding model, defaults to its model_name.
+        :param flush_every: Number of new vectors after which the cache is written to disk.
+        """
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_id = model_id or getattr(embeddings, 'model_name', type(embeddings).__name__)
+        self.flush_every = flush_every
+        self._unflushed = 0
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_id}\0{text}".encode('utf-8')).hexdigest()
+
+    def embed_documents(self, texts):
+        keys = [self._key(text) for text in texts]
+        vectors = self.cache.get(keys)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            new_vectors = self.embeddings.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+            self.cache.put([keys[i] for i in missing], new_vectors)
+            self._unflushed += len(missing)
+            if self._unflushed >= self.flush_every:
+                self.flush()
+        return vectors
+
+    def flush(self):
+        """
+        Write the new vectors and the index of the cache to disk.
+        """
+        if self._unflushed:
+            self.cache.flush()
+            self._unflushed = 0
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
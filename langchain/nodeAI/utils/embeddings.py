@@ -0,0 +1,74 @@
+import json
+import threading
+from langchain_huggingface import HuggingFaceEmbeddings
+
+DEFAULT_MODEL_NAME = "sentence-transformers/all-mpnet-base-v2"
+
+class EmbeddingPool:
+    """
+    Process-wide registry of embedding models.
+
+    Models are keyed by model name and device/encode settings, so every tool asking for the
+    same configuration shares a single instance. Each acquire() increments a reference count,
+    the model is dropped from the pool when the last reference is released.
+    """
+    _lock = threading.Lock()
+    _models = {}
+    _refcounts = {}
+
+    @staticmethod
+    def _key(model_name, model_kwargs, encode_kwargs):
+        return (
+            model_name,
+            json.dumps(model_kwargs or {}, sort_keys=True),
+            json.dumps(encode_kwargs or {}, sort_keys=True)
+        )
+
+    @classmethod
+    def acquire(cls, model_name: str = DEFAULT_MODEL_NAME, model_kwargs: dict = None, encode_kwargs: dict = None):
+        """
+        Get a shared embedding model, loading it on first use.
+
+        :param model_name: Name of the sentence-transformers model.
+        :param model_kwargs: Optional model settings (e.g. {'device': 'cpu'}).
+        :param encode_kwargs: Optional encode settings (e.g. {'normalize_embeddings': True}).
+        :return: HuggingFaceEmbeddings instance.
+        """
+        key = cls._key(model_name, model_kwargs, encode_kwargs)
+        with cls._lock:
+            if key not in cls._models:
+                cls._models[key] = HuggingFaceEmbeddings(
+                    model_name=model_name,
+                    model_kwargs=model_kwargs or {},
+                    encode_kwargs=encode_kwargs or {}
+                )
+                cls._refcounts[key] = 0
+            cls._refcounts[key] += 1
+            return cls._models[key]
+
+    @classmethod
+    def release(cls, embeddings):
+        """
+        Release a reference obtained by acquire(). The model is unloaded when no references are left.
+
+        :param embeddings: The embedding instance returned by acquire().
+        """
+        with cls._lock:
+            for key, model in list(cls._models.items()):
+                if model is embeddings:
+                    cls._refcounts[key] -= 1
+                    if cls._refcounts[key] <= 0:
+                        del cls._models[key]
+                        del cls._refcounts[key]
+                    return
+
+    @classmethod
+    def get_status(cls):
+        """
+        Get the loaded models and their reference counts.
+
+        :return: List of dicts with model name and reference count.
+        """
+        with cls._lock:
+            return [{'model_name': key[0], 'model_kwargs': key[1], 'encode_kwargs': key[2], 'references': cls._refcounts[key]}
+                    for key in cls._models]
@@ -0,0 +1,103 @@
+import json
+import time
+import threading
+from collections import deque
+
+def estimate_tokens(text):
+    """
+    Estimate the number of tokens of a text (about 4 characters per token).
+    """
+    return len(text or "") // 4
+
+class AgentHistory:
+    """
+    Bounded history of agent queries.
+
+    Keeps the most recent entries in a ring buffer. Each entry holds the question, the size of the
+    context, the answer and timing and token counts. Evicted entries can be appended to a JSONL file.
+    """
+    def __init__(self, max_entries: int = 100, spill_path: str = None):
+        """
+        :param max_entries: Maximum number of entries kept in memory, at least 1.
+        :param spill_path: Optional JSONL file the evicted entries are appended to.
+        """
+        if max_entries < 1:
+            raise ValueError(f"max_entries must be at least 1, got {max_entries}")
+        self.entries = deque(maxlen=max_entries)
+        self.spill_path = spill_path
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def add(self, question: str, context: str, output: str, seconds: float, cached: bool = False):
+        """
+        Add an entry for a query.
+
+        :param question: The question without context.
+        :param context: The context passed with the question, only its size is stored.
+        :param output: The answer.
+        :param seconds: Duration of the query.
+        :param cached: True if the answer was served from the response cache.
+        """
+        entry = {
+            'id': self.total,
+            'timestamp': time.time(),
+            'question': question,
+            'context_chars': len(context or ""),
+            'output': output,
+            'seconds': seconds,
+            'input_tokens': estimate_tokens(question) + estimate_tokens(context),
+            'output_tokens': estimate_tokens(output),
+            'cached': cached
+        }
+        with self._lock:
+            if self.spill_path and len(self.entries) == self.entries.maxlen:
+                with open(self.spill_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(self.entries[0]) + "\n")
+            self.entries.append(entry)
+            self.total += 1
+        return entry
+
+    def page(self, offset: int = 0, limit: int = 10):
+        """
+        Get a page of entries, newest first.
+
+        Pages beyond the entries kept in memory are read from the spill file if there is one.
+
+        :param offset: Number of newest entries to skip.
+        :param limit: Maximum number of entries returned.
+        :return: Dict with the total number of queries, the number kept in memory and the entries.
+        """
+        with self._lock:
+            newest_first = list(reversed(self.entries))
+            in_memory = len(newest_first)
+            if self.spill_path and offset + limit > in_memory:
+                newest_first += self._read_spilled(offset + limit - in_memory)
+        return {
+            'total': self.total,
+            'in_memory': in_memory,
+            'offset': offset,
+            'entries': newest_first[offset:offset + limit]
+        }
+
+    def _read_spilled(self, count):
+        """
+        Read the newest spilled entries, newest first.
+
+        :param count: Maximum number of entries.
+        """
+        try:
+            with open(self.spill_path, 'r', encoding='utf-8') as f:
+                lines = deque(f, maxlen=count)
+        except FileNotFoundError:
+            return []
+        return [json.loads(line) for line in reversed(lines)]
+
+    def last(self):
+        """
+        Get the most recent entry or None.
+        """
+        with self._lock:
+            return self.entries[-1] if self.entries else None
+
+    def __len__(self):
+        return len(self.entries)
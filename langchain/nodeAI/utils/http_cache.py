@@ -0,0 +1,65 @@
+import os
+import json
+import hashlib
+
+class HttpCache:
+    """
+    On-disk cache of HTTP responses for conditional requests.
+
+    For every URL the body is stored together with its ETag and Last-Modified headers, so a
+    later request can ask the server whether the page changed and reuse the body on 304.
+    """
+    def __init__(self, directory: str):
+        """
+        :param directory: Directory holding one JSON file per cached URL.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode('utf-8')).hexdigest() + ".json")
+
+    def get(self, url):
+        """
+        Get the cached entry of a URL.
+
+        :param url: URL of the page.
+        :return: Dict with url, etag, last_modified and body, or None if not cached.
+        """
+        try:
+            with open(self._path(url), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def get_conditional_headers(self, entry):
+        """
+        Get the headers for a conditional request of a cached entry.
+
+        :param entry: Entry returned by get().
+        :return: Dict of request headers.
+        """
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def put(self, url, response):
+        """
+        Store a response if it carries validators (ETag or Last-Modified).
+
+        :param url: URL of the page.
+        :param response: requests.Response with status 200.
+        """
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+        entry = {'url': url, 'etag': etag, 'last_modified': last_modified, 'body': response.text}
+        path = self._path(url)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,86 @@
+import json
+import hashlib
+import threading
+import requests
+
+try:
+    # Keeps one httpx client with a keep-alive connection pool per instance
+    from langchain_ollama import OllamaLLM as Ollama
+except ImportError:
+    # Sends every request with a bare requests.post, i.e. without connection pooling
+    from langchain_community.llms import Ollama
+
+DEFAULT_OLLAMA_URL = "http://localhost:11434"
+
+class LLMRegistry:
+    """
+    Process-wide registry of LLM clients.
+
+    Clients are keyed by provider, model, base URL and credentials, so all agents using the same
+    configuration share one client. ChatGroq clients share their HTTP connection pool, Ollama
+    clients only if langchain_ollama is installed: the langchain_community fallback opens a new
+    connection per request.
+    """
+    _lock = threading.Lock()
+    _clients = {}
+
+    @staticmethod
+    def _key(provider, model, api_key, base_url, kwargs):
+        # Keep only a hash of the API key in the key
+        api_key_hash = hashlib.sha256(api_key.encode('utf-8')).hexdigest() if api_key else None
+        return (provider, model, base_url, api_key_hash, json.dumps(kwargs, sort_keys=True))
+
+    @classmethod
+    def get(cls, provider: str, model: str, api_key: str = None, base_url: str = None, **kwargs):
+        """
+        Get a shared LLM client, creating it on first use.
+
+        :param provider: 'Ollama' or 'ChatGroq'.
+        :param model: The model name.
+        :param api_key: API key (required for ChatGroq).
+        :param base_url: Optional server URL (Ollama).
+        :param kwargs: Additional client settings, e.g. temperature.
+        :return: LLM client.
+        """
+        key = cls._key(provider, model, api_key, base_url, kwargs)
+        with cls._lock:
+            if key not in cls._clients:
+                if provider == 'Ollama':
+                    cls._clients[key] = Ollama(model=model, base_url=base_url or DEFAULT_OLLAMA_URL, **kwargs)
+                elif provider == 'ChatGroq':
+                    if not api_key:
+                        raise ValueError("API key is required for ChatGroq.")
+                    from langchain_groq import ChatGroq
+                    cls._clients[key] = ChatGroq(model=model, api_key=api_key, **kwargs)
+                else:
+                    raise ValueError(f"Unsupported model: {provider}")
+            return cls._clients[key]
+
+    @classmethod
+    def warm_up(cls, model: str, base_url: str = None, keep_alive: str = "30m"):
+        """
+        Load an Ollama model into memory before the first query.
+
+        A generate request without prompt makes Ollama load the model and keep it loaded for
+        keep_alive, so the first real request does not pay the model load time.
+
+        :param model: The model name.
+        :param base_url: Optional Ollama server URL.
+        :param keep_alive: How long Ollama keeps the model loaded (e.g. '30m', '-1' for ever).
+        :return: True if the model was loaded.
+        """
+        try:
+            response = requests.post(f"{base_url or DEFAULT_OLLAMA_URL}/api/generate",
+                                     json={'model': model, 'keep_alive': keep_alive}, timeout=300)
+            return response.status_code == 200
+        except requests.RequestException as e:
+            print(f"Failed to warm up {model}: {e}")
+            return False
+
+    @classmethod
+    def clear(cls):
+        """
+        Drop all shared clients.
+        """
+        with cls._lock:
+            cls._clients.clear()
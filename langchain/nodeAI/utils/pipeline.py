@@ -0,0 +1,97 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+class Pipeline:
+    """
+    Run agents as nodes of a dependency graph.
+
+    Every node queries an agent with a question, the outputs of the nodes listed as its inputs
+    are passed as context. Nodes whose inputs are available run concurrently, so the total
+    runtime is the critical path of the graph instead of the sum of all queries.
+    """
+    def __init__(self, max_workers: int = 4):
+        """
+        :param max_workers: Maximum number of agent queries running at the same time.
+        """
+        self.max_workers = max_workers
+        self.nodes = {}
+        self.outputs = {}
+        self.timings = {}
+
+    def add(self, name: str, agent, question: str, inputs: list = None):
+        """
+        Add a node to the pipeline.
+
+        :param name: Unique name of the node, used to reference it as input of other nodes.
+        :param agent: Agent to be queried. An agent should only be used by one node, queries of the same agent are not thread safe.
+        :param question: Question for the agent.
+        :param inputs: Names of the nodes whose outputs are passed as context.
+        """
+        if name in self.nodes:
+            raise ValueError(f"Node already exists: {name}")
+        self.nodes[name] = {'agent': agent, 'question': question, 'inputs': inputs or []}
+        return self
+
+    def _validate(self):
+        """
+        Check that all inputs exist and the graph has no cycles.
+        """
+        for name, node in self.nodes.items():
+            for input in node['inputs']:
+                if input not in self.nodes:
+                    raise ValueError(f"Unknown input '{input}' of node '{name}'")
+
+        done = set()
+        remaining = dict(self.nodes)
+        while remaining:
+            ready = [name for name, node in remaining.items() if all(input in done for input in node['inputs'])]
+            if not ready:
+                raise ValueError(f"Cycle between nodes: {', '.join(remaining)}")
+            for name in ready:
+                done.add(name)
+                del remaining[name]
+
+    def _run_node(self, name, context):
+        node = self.nodes[name]
+        start = time.perf_counter()
+        output = node['agent'].query(node['question'], context)
+        self.timings[name] = time.perf_counter() - start
+        return output
+
+    def get_context(self, name):
+        """
+        Build the context of a node from the outputs of its inputs.
+
+        :param name: Name of the node.
+        :return: Context string or None if the node has no inputs.
+        """
+        inputs = self.nodes[name]['inputs']
+        if not inputs:
+            return None
+        return "\n\n".join(f"{input} Result: {self.outputs[input]}" for input in inputs)
+
+    def run(self):
+        """
+        Run all nodes, each as soon as all of its inputs are available.
+
+        :return: Dict of node name to the output of its agent.
+        """
+        self._validate()
+        self.outputs = {}
+        self.timings = {}
+        pending = dict(self.nodes)
+        running = {}
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for name in [name for name, node in pending.items() if all(input in self.outputs for input in node['inputs'])]:
+                    del pending[name]
+                    running[executor.submit(self._run_node, name, self.get_context(name))] = name
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    self.outputs[running.pop(future)] = future.result()
+        self.timings['total'] = time.perf_counter() - start
+
+        return self.outputs
@@ -1,81 +1,170 @@
+from concurrent.futures import ProcessPoolExecutor
 from langchain_community.document_loaders import PDFPlumberLoader
 from langchain_text_splitters import CharacterTextSplitter
 
 from .tool import Tool, Document
 
+def _get_text_splitter():
+    return CharacterTextSplitter(
+        separator="\n",
+        chunk_size=2000,
+        chunk_overlap=200
+    )
+
+def load_and_split(file_path):
+    """
+    Load a PDF or TXT file and split it into chunks.
+
+    Defined at module level so it can be run in worker processes.
+
+    :param file_path: Path to the file.
+    :return: List of chunks, or None if the file type is not supported.
+    """
+    if file_path.lower().endswith('.pdf'):
+        loader = PDFPlumberLoader(file_path)
+        docs = loader.load()
+    elif file_path.lower().endswith('.txt'):
+        with open(file_path, 'r', encoding='utf-8') as file:
+            text = file.read()
+        # Wrap text in a Document-like object with metadata
+        docs = [Document(content=text, metadata={'source': file_path})]
+    else:
+        return None
+
+    return _get_text_splitter().split_documents(docs)
+
+def iter_chunks(file_path, block_size: int = 1024 * 1024):
+    """
+    Lazily load a PDF or TXT file and yield its chunks.
+
+    PDFs are read page by page, text files in blocks of whole lines of about block_size
+    characters, so only one page or block is held in memory. Chunks do not span block boundaries.
+
+    :param file_path: Path to the file.
+    :param block_size: Approximate number of characters read from a text file at once.
+    :return: Generator of chunks.
+    """
+    text_splitter = _get_text_splitter()
+    if file_path.lower().endswith('.pdf'):
+        for page in PDFPlumberLoader(file_path).lazy_load():
+            yield from text_splitter.split_documents([page])
+    elif file_path.lower().endswith('.txt'):
+        with open(file_path, 'r', encoding='utf-8') as file:
+            while True:
+                lines = file.readlines(block_size)
+                if not lines:
+                    break
+                document = Document(content=''.join(lines), metadata={'source': file_path})
+                yield from text_splitter.split_documents([document])
+    else:
+        raise ValueError(f"Unsupported file type: {file_path}")
+
 class RAGTool(Tool):
-    def __init__(self, name: str, file_paths:list):
+    def __init__(self, name: str, file_paths:list, workers: int = 1, streaming: bool = False, **kwargs):
         """
         Initialize the RAGTool class with a list of file paths.
-        
+
         :param file_paths: List of paths to the files to be loaded and processed.
+        :param workers: Number of worker processes used to parse and split the files (1 = no worker processes).
+        :param streaming: Stream chunks lazily from the files into the index, memory is bounded by the batch size
+                          instead of the file size (files are processed without worker processes).
+        :param kwargs: Additional options passed to Tool (e.g. embedding_model).
         """
-        super().__init__(name, file_paths) 
+        super().__init__(name, file_paths, **kwargs)
+        self.workers = workers
+        self.streaming = streaming
         self.load()
-    
+
     def load(self):
         """
         Load and process a list of files based on their suffixes.
-        
-        :param file_paths: List of paths to the files.
+
+        With more than one worker the files are parsed and split in a process pool, the chunks
+        are indexed file by file in source order while the workers continue with the next files.
+        In streaming mode the chunks go from the loader to the index without being collected.
         """
+        sources = []
         for source in self.sources:
-            print(f"Loading {source}...")
-            if source.lower().endswith('.pdf'):
-                self.load_pdf(source)
-            elif source.lower().endswith('.txt'):
-                self.load_txt(source)
+            if self.is_source_unchanged(source):
+                print(f"Skipping {source}, unchanged since it was indexed.")
             else:
-                print(f"Unsupported file type: {source}")
-            print()
+                sources.append(source)
+        self.remove_sources(sources)
+
+        if self.streaming:
+            for source in sources:
+                print(f"Loading {source}...")
+                if not source.lower().endswith(('.pdf', '.txt')):
+                    print(f"Unsupported file type: {source}")
+                    continue
+                count = self.index_chunks(iter_chunks(source))
+                print(f"   {self.name} - Number of chunks indexed: {count}")
+                print()
+        elif self.workers > 1 and len(sources) > 1:
+            # The with block must stay open while iterating, map() yields results in source order
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                for source, texts in zip(sources, executor.map(load_and_split, sources)):
+                    print(f"Loading {source}...")
+                    self._add_chunks(source, texts)
+                    print()
+        else:
+            for source in sources:
+                print(f"Loading {source}...")
+                if source.lower().endswith('.pdf'):
+                    self.load_pdf(source)
+                elif source.lower().endswith('.txt'):
+                    self.load_txt(source)
+                else:
+                    print(f"Unsupported file type: {source}")
+                if self.documents:
+                    self._reprocess_documents()
+                print()
 
         super().load()
-    
+
+    def _add_chunks(self, source, texts):
+        """
+        Index the chunks of a file parsed in a worker process.
+
+        :param source: Path to the file.
+        :param texts: List of chunks returned by load_and_split.
+        """
+        if texts is None:
+            print(f"Unsupported file type: {source}")
+            return
+        print(f"   {self.name} - Number of chunks: {len(texts)}")
+        for text in texts:
+            print(f"   {self.name} - Content: ", text.page_content.replace('\n', '')[:50])
+        self.documents.extend(texts)
+        if self.documents:
+            self._reprocess_documents()
+
     def load_pdf(self, file_path):
         """
         Load and process a single PDF file.
-        
+
         :param file_path: Path to the PDF file.
         """
-        loader = PDFPlumberLoader(file_path)
-        docs = loader.load()
-        
         print(f"   {self.name} - Splitting into chunks from PDF...")
-        text_splitter = CharacterTextSplitter(
-            separator="\n",
-            chunk_size=2000,
-            chunk_overlap=200
-        )
-        texts = text_splitter.split_documents(docs)
+        texts = load_and_split(file_path)
         print(f"   {self.name} - Number of chunks: {len(texts)}")
         for text in texts:
             print(f"   {self.name} - Content: ", text.page_content.replace('\n', '')[:50])
 
         print(f"   {self.name} - Adding PDF chunks to the collection...")
         self.documents.extend(texts)
-    
+
     def load_txt(self, file_path):
         """
         Load and process a single text file.
-        
+
         :param file_path: Path to the text file.
         """
-        with open(file_path, 'r', encoding='utf-8') as file:
-            text = file.read()
-        
-        # Wrap text in a Document-like object with metadata
         print(f"   {self.name} - Splitting into chunks from TXT...")
-        document = Document(content=text, metadata={'source': file_path})
-        text_splitter = CharacterTextSplitter(
-            separator="\n",
-            chunk_size=2000,
-            chunk_overlap=200
-        )
-        texts = text_splitter.split_documents([document])
+        texts = load_and_split(file_path)
         print(f"   {self.name} - Number of chunks: {len(texts)}")
         for text in texts:
             print(f"   {self.name} - Content: ", text.page_content.replace('\n', '')[:50])
 
         print(f"   {self.name} - Adding TXT chunks to the collection...")
         self.documents.extend(texts)
-    
\ No newline at end of file
@@ -0,0 +1,109 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any
+from langchain_core.retrievers import BaseRetriever
+
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+class CrossEncoderReranker:
+    """
+    Re-rank retrieved chunks with a local cross-encoder and keep only the best ones.
+
+    The cross-encoder reads question and chunk together, which ranks more precisely than the
+    vector search but is too slow for the whole index, so it is applied to an over-fetched
+    candidate list. Scores are cached per (question, chunk) pair in an LRU.
+    """
+    def __init__(self, model_name: str = DEFAULT_RERANK_MODEL, top_n: int = 4, batch_size: int = 32,
+                 cache_size: int = 10000, model_kwargs: dict = None):
+        """
+        :param model_name: Name of the sentence-transformers cross-encoder model.
+        :param top_n: Number of chunks kept per question.
+        :param batch_size: Number of (question, chunk) pairs scored at once.
+        :param cache_size: Maximum number of cached scores.
+        :param model_kwargs: Optional model settings (e.g. {'device': 'cpu'}).
+        """
+        self.model_name = model_name
+        self.top_n = top_n
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        # Imported here, sentence_transformers is only needed when re-ranking is used
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, **(model_kwargs or {}))
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(query, document):
+        return hashlib.sha256(f"{query}\0{document.page_content}".encode('utf-8')).hexdigest()
+
+    def rerank_batch(self, queries: list, documents: list, top_n: int = None):
+        """
+        Re-rank the candidates of many questions, all uncached pairs are scored in one batched call.
+
+        :param queries: List of questions.
+        :param documents: List with the candidate documents of each question.
+        :param top_n: Number of documents kept per question, defaults to self.top_n.
+        :return: List with the best documents of each question, best first.
+        """
+        keys = [[self._key(query, document) for document in candidates] for query, candidates in zip(queries, documents)]
+        scores = {}
+        missing = {}
+        with self._lock:
+            for query, candidates, candidate_keys in zip(queries, documents, keys):
+                for document, key in zip(candidates, candidate_keys):
+                    if key in self.cache:
+                        self.cache.move_to_end(key)
+                        scores[key] = self.cache[key]
+                        self.hits += 1
+                    elif key not in missing:
+                        missing[key] = (query, document.page_content)
+                        self.misses += 1
+
+        if missing:
+            predicted = self.model.predict(list(missing.values()), batch_size=self.batch_size)
+            with self._lock:
+                for key, score in zip(missing, predicted):
+                    scores[key] = self.cache[key] = float(score)
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+
+        top_n = top_n or self.top_n
+        results = []
+        for candidates, candidate_keys in zip(documents, keys):
+            ranked = sorted(zip(candidates, candidate_keys), key=lambda pair: scores[pair[1]], reverse=True)
+            results.append([document for document, _ in ranked[:top_n]])
+        return results
+
+    def rerank(self, query: str, documents: list, top_n: int = None):
+        """
+        Re-rank the candidates of one question.
+
+        :return: The best documents, best first.
+        """
+        return self.rerank_batch([query], [documents], top_n)[0]
+
+    def get_status(self):
+        """
+        Get the size and hit rate of the score cache.
+        """
+        lookups = self.hits + self.misses
+        return {
+            'model_name': self.model_name,
+            'entries': len(self.cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+class RerankingRetriever(BaseRetriever):
+    """
+    Retriever passing the candidates of another retriever through a CrossEncoderReranker.
+    """
+    retriever: BaseRetriever
+    reranker: Any
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.reranker.rerank(query, self.retriever.invoke(query))
@@ -0,0 +1,134 @@
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+class ResponseCache:
+    """
+    Cache of agent answers keyed by provider, model, tool fingerprint and normalised input.
+
+    Exact hits are served from an in-memory LRU, optionally backed by a SQLite file so answers
+    survive restarts. With an embedding model a semantic mode reuses the answer of an earlier
+    input of the same scope (provider, model, tool) whose embedding is within the similarity threshold.
+    """
+    def __init__(self, max_entries: int = 1000, db_path: str = None, embeddings=None, similarity_threshold: float = 0.95):
+        """
+        :param max_entries: Maximum number of answers kept in memory.
+        :param db_path: Optional SQLite file for persistent exact-match entries.
+        :param embeddings: Optional embedding model, enables the semantic mode.
+        :param similarity_threshold: Minimum cosine similarity for a semantic hit.
+        """
+        self.max_entries = max_entries
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._lock = threading.Lock()
+        self.db = None
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, answer TEXT, latency REAL, created REAL)")
+            self.db.commit()
+
+    @staticmethod
+    def normalize(text):
+        return re.sub(r"\s+", " ", text).strip().lower()
+
+    def make_key(self, provider, model, tool_fingerprint, text):
+        """
+        Build the cache key of a query.
+
+        :return: Tuple of (scope, key), the scope groups entries which may be compared semantically.
+        """
+        scope = json.dumps([provider, model, tool_fingerprint])
+        key = hashlib.sha256(f"{scope}\0{self.normalize(text)}".encode('utf-8')).hexdigest()
+        return scope, key
+
+    def _embed(self, text):
+        vector = np.asarray(self.embeddings.embed_query(self.normalize(text)), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def get(self, scope, key, text):
+        """
+        Look up an answer, first exactly and then (if enabled) semantically.
+
+        :param scope: Scope returned by make_key.
+        :param key: Key returned by make_key.
+        :param text: Input text, embedded for the semantic lookup.
+        :return: Cached answer or None.
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return self._hit(entry, semantic=False)
+            if self.db is not None:
+                row = self.db.execute("SELECT answer, latency FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = {'scope': scope, 'answer': row[0], 'latency': row[1] or 0.0, 'vector': None}
+                    self._store(key, entry)
+                    return self._hit(entry, semantic=False)
+
+        if self.embeddings is not None:
+            vector = self._embed(text)
+            with self._lock:
+                candidates = [(k, e) for k, e in self.entries.items() if e['scope'] == scope and e['vector'] is not None]
+                if candidates:
+                    similarities = np.stack([e['vector'] for _, e in candidates]) @ vector
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.similarity_threshold:
+                        self.entries.move_to_end(candidates[best][0])
+                        return self._hit(candidates[best][1], semantic=True)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _hit(self, entry, semantic):
+        self.hits += 1
+        if semantic:
+            self.semantic_hits += 1
+        self.saved_seconds += entry['latency']
+        return entry['answer']
+
+    def _store(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def put(self, scope, key, text, answer, latency: float = 0.0):
+        """
+        Store an answer.
+
+        :param latency: Time the LLM call took, reported as saved time on later hits.
+        """
+        vector = self._embed(text) if self.embeddings is not None else None
+        with self._lock:
+            self._store(key, {'scope': scope, 'answer': answer, 'latency': latency, 'vector': vector})
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO responses (key, answer, latency, created) VALUES (?, ?, ?, ?)",
+                                (key, answer, latency, time.time()))
+                self.db.commit()
+
+    def get_status(self):
+        """
+        Get the hit rate and the saved latency of the cache.
+        """
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'semantic_hits': self.semantic_hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'saved_seconds': self.saved_seconds
+        }
@@ -0,0 +1,166 @@
+import os
+import threading
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+from .embeddings import EmbeddingPool, DEFAULT_MODEL_NAME
+from .embedding_cache import EmbeddingCache, CachedEmbeddings
+from .ann_index import embed_queries
+
+class SharedIndex:
+    """
+    One FAISS index shared by many tools.
+
+    Every chunk is tagged with the name of its tool in the 'tool' metadata field. The index keeps
+    the positions of each tool's chunks, a search restricted to some tools is a single FAISS search
+    over all queries with an ID selector, so many small tools need neither their own index nor
+    their own embedding model.
+    The index is kept flat (exact): approximate indexes lose most results when a selector filters
+    out the majority of the vectors.
+    Tools do not save the shared index, call save() once after loading or updating them.
+    """
+    def __init__(self, embedding_model: str = DEFAULT_MODEL_NAME, model_kwargs: dict = None, cache_dir: str = None,
+                 persist_directory: str = None, name: str = "shared"):
+        """
+        :param embedding_model: Name of the embedding model used by all tools of the index.
+        :param model_kwargs: Optional model settings for the embedding model (e.g. {'device': 'cpu'}).
+        :param cache_dir: Optional directory of a persistent embedding cache.
+        :param persist_directory: Optional directory to save the index to and reload it from on startup.
+        :param name: File name of the index in the persist directory.
+        """
+        self.name = name
+        self.embedding_model = EmbeddingPool.acquire(embedding_model, model_kwargs)
+        self.embeddings = self.embedding_model
+        if cache_dir:
+            self.embeddings = CachedEmbeddings(self.embedding_model, EmbeddingCache.open(cache_dir))
+        self.persist_directory = persist_directory
+        self.db = None
+        self.positions = {}
+        self._lock = threading.RLock()
+        if self.persist_directory and os.path.exists(os.path.join(self.persist_directory, f"{self.name}.faiss")):
+            # The docstore is a pickle written by save(), only load directories you trust
+            self.db = FAISS.load_local(self.persist_directory, self.embeddings, index_name=self.name, allow_dangerous_deserialization=True)
+            self._update_positions()
+
+    def release(self):
+        """
+        Release the shared embedding model held by this index.
+        """
+        if isinstance(self.embeddings, CachedEmbeddings):
+            self.embeddings.flush()
+        if self.embedding_model is not None:
+            EmbeddingPool.release(self.embedding_model)
+            self.embedding_model = None
+            self.embeddings = None
+
+    def _update_positions(self):
+        """
+        Rebuild the index positions of each tool from the chunk metadata.
+        """
+        positions = {}
+        for position, id in self.db.index_to_docstore_id.items():
+            positions.setdefault(self.db.docstore.search(id).metadata.get('tool'), []).append(position)
+        self.positions = positions
+
+    def add(self, tool: str, texts: list, vectors: list, metadatas: list, ids: list):
+        """
+        Add the embedded chunks of a tool.
+
+        :param tool: Name of the tool.
+        :param texts: Chunk texts.
+        :param vectors: Embedding vectors of the chunks.
+        :param metadatas: Metadata of the chunks, the tool name is added as 'tool'.
+        :param ids: Docstore ids of the chunks.
+        """
+        metadatas = [dict(metadata, tool=tool) for metadata in metadatas]
+        with self._lock:
+            start = 0 if self.db is None else self.db.index.ntotal
+            if self.db is None:
+                self.db = FAISS.from_embeddings(list(zip(texts, vectors)), self.embeddings, metadatas=metadatas, ids=ids)
+            else:
+                self.db.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+            self.positions.setdefault(tool, []).extend(range(start, start + len(ids)))
+
+    def delete(self, ids: list):
+        """
+        Delete chunks by their docstore ids.
+        """
+        with self._lock:
+            reverse = {id: position for position, id in self.db.index_to_docstore_id.items()}
+            removed = np.sort(np.array([reverse[id] for id in ids], dtype=np.int64))
+            self.db.delete(ids)
+            # Removing vectors from a flat index shifts each later vector down by the number of removed vectors before it
+            updated = {}
+            for tool, positions in self.positions.items():
+                positions = np.array(positions, dtype=np.int64)
+                positions = positions[~np.isin(positions, removed)]
+                if len(positions):
+                    updated[tool] = (positions - np.searchsorted(removed, positions)).tolist()
+            self.positions = updated
+
+    def get_manifest(self, tool: str):
+        """
+        Rebuild the manifest of a tool from the metadata of its chunks.
+
+        :param tool: Name of the tool.
+        :return: Dict of source to {'signature': ..., 'ids': [...]}, like Tool.manifest.
+        """
+        manifest = {}
+        with self._lock:
+            for position in self.positions.get(tool, []):
+                id = self.db.index_to_docstore_id[position]
+                metadata = self.db.docstore.search(id).metadata
+                entry = manifest.setdefault(metadata.get('source'), {'signature': metadata.get('signature'), 'ids': []})
+                entry['ids'].append(id)
+        return manifest
+
+    def search_batch(self, queries: list, k: int = 4, tools: list = None):
+        """
+        Retrieve the documents for many queries with one embedding batch and one FAISS search.
+
+        :param queries: List of query strings.
+        :param k: Number of documents per query.
+        :param tools: Optional names of the tools to search, by default all chunks are searched.
+        :return: List with the list of documents for each query.
+        """
+        results = self.search_ids(queries, k, tools)
+        with self._lock:
+            return [[self.db.docstore.search(id) for id in ids] for ids in results]
+
+    def search_ids(self, queries: list, k: int = 4, tools: list = None):
+        """
+        Like search_batch, but returns the docstore ids of the documents.
+        """
+        vectors = embed_queries(self.embeddings, queries)
+        with self._lock:
+            if self.db is None:
+                return [[] for _ in queries]
+            params = None
+            if tools is not None:
+                positions = np.array([p for tool in tools for p in self.positions.get(tool, [])], dtype=np.int64)
+                if not len(positions):
+                    return [[] for _ in queries]
+                params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(positions))
+            _, indices = self.db.index.search(vectors, k, params=params)
+            return [[self.db.index_to_docstore_id[i] for i in row if i != -1] for row in indices]
+
+    def save(self):
+        """
+        Save the index and its docstore to the persist directory.
+        """
+        if not self.persist_directory or self.db is None:
+            return
+        os.makedirs(self.persist_directory, exist_ok=True)
+        with self._lock:
+            self.db.save_local(self.persist_directory, index_name=self.name)
+
+    def get_status(self):
+        """
+        Get the number of chunks in the index and per tool.
+        """
+        with self._lock:
+            return {
+                'chunks': 0 if self.db is None else self.db.index.ntotal,
+                'tools': {tool: len(positions) for tool, positions in self.positions.items()}
+            }
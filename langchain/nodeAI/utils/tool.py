@@ -1,5 +1,20 @@
-from langchain_huggingface import HuggingFaceEmbeddings
+import os
+import json
+import pickle
+import time
+import hashlib
+import uuid
+from itertools import islice
+from typing import Callable
 from langchain_community.vectorstores import FAISS
+from langchain_core.retrievers import BaseRetriever
+
+from .embeddings import EmbeddingPool, DEFAULT_MODEL_NAME
+from .embedding_cache import EmbeddingCache, CachedEmbeddings
+from .ann_index import (COMPRESSED_INDEX_TYPES, ExactVectors, build_index, convert_index, embed_queries, evaluate_index,
+                        get_index_type, get_vectors, keeps_exact_vectors, rerank_positions, supports_remove)
+from .shared_index import SharedIndex
+from .bm25 import BM25Index, reciprocal_rank_fusion
 
 class Document:
     """
@@ -9,14 +24,114 @@ class Document:
         self.page_content = content
         self.metadata = metadata or {}
 
+def similarity_search_batch(db, embeddings, queries, k: int = 4, rerank: int = 0, exact_vectors: ExactVectors = None):
+    """
+    Search a FAISS vector store for many queries at once.
+
+    The index is searched once with the whole query matrix.
+
+    :param db: FAISS vector store.
+    :param embeddings: Embedding model of the vector store.
+    :param queries: List of query strings.
+    :param k: Number of documents per query.
+    :param rerank: Over-fetch factor, k * rerank candidates of a compressed (fp16, int8, pq) index are re-ranked with exact vectors.
+    :param exact_vectors: ExactVectors of the index, required for rerank.
+    :return: List with the list of documents for each query.
+    """
+    return [[db.docstore.search(id) for id in ids] for ids in similarity_search_ids(db, embeddings, queries, k, rerank, exact_vectors)]
+
+def similarity_search_ids(db, embeddings, queries, k: int = 4, rerank: int = 0, exact_vectors: ExactVectors = None):
+    """
+    Like similarity_search_batch, but returns the docstore ids of the documents.
+    """
+    vectors = embed_queries(embeddings, queries)
+    if rerank > 1 and get_index_type(db.index) in COMPRESSED_INDEX_TYPES:
+        if exact_vectors is None:
+            raise ValueError("Re-ranking needs the exact vectors of the index.")
+        _, candidates = db.index.search(vectors, k * rerank)
+        indices = rerank_positions(exact_vectors, vectors, candidates, k)
+    else:
+        _, indices = db.index.search(vectors, k)
+    results = []
+    for row in indices:
+        # FAISS returns -1 if the index holds fewer than k vectors
+        results.append([db.index_to_docstore_id[i] for i in row if i != -1])
+    return results
+
+class SearchRetriever(BaseRetriever):
+    """
+    Retriever calling a batch search function, e.g. Tool.search_batch, with a single query.
+    """
+    search: Callable
+    k: int = 4
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.search([query], self.k)[0]
+
 class Tool:
-    def __init__(self, name:str, sources:list):
+    def __init__(self, name:str, sources:list, embedding_model: str = DEFAULT_MODEL_NAME, model_kwargs: dict = None, cache_dir: str = None, persist_directory: str = None, batch_size: int = 32,
+                 index_type: str = 'flat', index_params: dict = None, rerank: int = 0, shared_index: SharedIndex = None,
+                 hybrid: bool = False):
+        """
+        Initialize the Tool with a list of sources.
+
+        :param name: Name of the tool instance.
+        :param sources: List of sources (file paths, URLs) to be processed.
+        :param embedding_model: Name of the embedding model, shared with all tools using the same model.
+        :param model_kwargs: Optional model settings for the embedding model (e.g. {'device': 'cpu'}).
+        :param cache_dir: Optional directory of a persistent embedding cache, unchanged chunks are not embedded again.
+        :param persist_directory: Optional directory to save the FAISS index to and reload it from on startup.
+        :param batch_size: Number of chunks passed to the embedding model at once.
+        :param index_type: FAISS index type: 'flat' (exact), 'ivf', 'hnsw', 'pq', 'fp16', 'int8' or 'auto' to choose by the number of chunks.
+        :param index_params: Optional index settings (e.g. {'nprobe': 16} or {'ef_search': 128}), see ann_index.build_index.
+        :param rerank: Over-fetch factor for compressed indexes ('pq', 'fp16', 'int8'), k * rerank candidates are re-ranked
+                       with exact vectors. Compressed indexes keep the exact float32 vectors in a memory-mapped file,
+                       '<name>.vectors.f32' in the persist directory or a temporary file.
+        :param shared_index: Optional SharedIndex the chunks are added to instead of an own FAISS index. The embedding model
+                             and cache of the shared index are used, index_type and rerank do not apply. The shared index
+                             is not saved by the tool, see SharedIndex.save().
+        :param hybrid: Keep a BM25 inverted index of the chunks next to FAISS and fuse keyword and vector results,
+                       so exact terms like model numbers and prices are found.
+        """
         self.debug_output = False
         self.name = name
         self.sources = sources
-        self.embeddings = HuggingFaceEmbeddings()
+        self.shared_index = shared_index
+        if self.shared_index:
+            self.embedding_model = None
+            self.embeddings = self.shared_index.embeddings
+        else:
+            self.embedding_model = EmbeddingPool.acquire(embedding_model, model_kwargs)
+            self.embeddings = self.embedding_model
+            if cache_dir:
+                self.embeddings = CachedEmbeddings(self.embedding_model, EmbeddingCache.open(cache_dir))
         self.db = None
         self.documents = []
+        self.persist_directory = persist_directory
+        self.manifest = {}
+        self.batch_size = batch_size
+        self.index_type = index_type
+        self.index_params = index_params
+        self.rerank = rerank
+        self.bm25 = BM25Index() if hybrid else None
+        self.exact_vectors = None
+        self.embedding_stats = {'chunks': 0, 'tokens': 0, 'seconds': 0.0}
+        self._fingerprint = None
+        if self.persist_directory or self.shared_index:
+            self._load_persisted()
+
+    def release(self):
+        """
+        Release the shared embedding model held by this tool.
+        """
+        self._flush_embedding_cache()
+        if self.embedding_model is not None:
+            EmbeddingPool.release(self.embedding_model)
+            self.embedding_model = None
+            self.embeddings = None
+        if self.exact_vectors is not None:
+            self.exact_vectors.close()
+            self.exact_vectors = None
 
     def get_sources(self):
         return self.sources
@@ -26,28 +141,333 @@ class Tool:
             self.sources.append(source)
 
     def load(self):
-        self._reprocess_documents()
+        """
+        Index the loaded documents, drop the chunks of sources which are no longer configured
+        and save the index (and the embedding cache) if a persist directory is set.
+        """
+        self.remove_sources([source for source in self.manifest if source not in self.sources])
+        if self.documents:
+            self._reprocess_documents()
+        if self.db is None:
+            raise RuntimeError("No documents loaded. Please load at least one document.")
+        if not self.shared_index:
+            self._apply_index_type()
+        self._flush_embedding_cache()
+        self.save()
+
+    def _flush_embedding_cache(self):
+        """
+        Write the embedding cache to disk once per ingestion instead of after every batch.
+        """
+        if isinstance(self.embeddings, CachedEmbeddings):
+            self.embeddings.flush()
+
+    def _apply_index_type(self):
+        """
+        Convert the FAISS index to the configured index type if it is of another type.
+        """
+        current = get_index_type(self.db.index)
+        index_type = convert_index(self.db, self.embeddings, self.index_type, self.index_params, self.exact_vectors)
+        if (self.debug_output and index_type != current): print(f"   {self.name} - Converted FAISS index from {current} to {index_type} ({self.db.index.ntotal} chunks)")
+
+    def evaluate_index(self, queries: list = None, k: int = 4, sample: int = 100):
+        """
+        Report the recall@k, search latency and memory of the FAISS index compared to an exact flat index.
+
+        :param queries: Optional query strings, by default a sample of the indexed chunks is used.
+        :param k: Number of results per query.
+        :param sample: Number of indexed chunks used as queries if no queries are given.
+        :return: Dict with index_type, ntotal, recall_at_k, latency_p50_ms, latency_p99_ms, memory_bytes, memory_saved
+                 and the flat baseline latencies and memory.
+        """
+        if not self.db:
+            raise RuntimeError("No documents have been processed. Please load documents before evaluating the index.")
+        return evaluate_index(self.db, self.embeddings, queries, k, sample, self.rerank, self.exact_vectors)
+
+    def is_source_unchanged(self, source):
+        """
+        Check if a source is already in the persisted index and unchanged since it was indexed.
+
+        :param source: Source (file path or URL) to check.
+        :return: True if the source does not need to be loaded again.
+        """
+        entry = self.manifest.get(source)
+        if entry is None or self.db is None:
+            return False
+        return entry['signature'] == self._get_source_signature(source)
+
+    def _get_source_signature(self, source):
+        """
+        Get the mtime and size of a file source, URLs have no signature.
+        """
+        if not os.path.exists(source):
+            return None
+        stat = os.stat(source)
+        return {'mtime': stat.st_mtime, 'size': stat.st_size}
+
+    def remove_sources(self, sources):
+        """
+        Remove all chunks of the given sources from the FAISS index.
+
+        :param sources: List of sources (file paths, URLs) to be removed.
+        """
+        ids = [id for source in sources if source in self.manifest for id in self.manifest.pop(source)['ids']]
+        if ids:
+            if (self.debug_output): print(f"   {self.name} - Removing {len(ids)} outdated chunks from FAISS index...")
+            if self.bm25 is not None:
+                self.bm25.delete(ids)
+            if self.shared_index:
+                self.shared_index.delete(ids)
+                self._fingerprint = None
+                return
+            if not supports_remove(self.db.index):
+                # Remove from an exact copy, load() converts back to the configured index type
+                self.db.index = build_index('flat', get_vectors(self.db, self.embeddings, self.exact_vectors))
+            if self.exact_vectors is not None:
+                positions = {id: position for position, id in self.db.index_to_docstore_id.items()}
+                self.exact_vectors.delete([positions[id] for id in ids])
+            self.db.delete(ids)
+            self._fingerprint = None
+
+    def save(self):
+        """
+        Save the FAISS index, its docstore and the manifest of indexed sources to the persist directory.
+
+        With a shared index nothing is saved here: the manifest is rebuilt from the shared index on startup and
+        SharedIndex.save() saves the shared index once for all tools.
+        """
+        if not self.persist_directory or self.db is None or self.shared_index:
+            return
+        os.makedirs(self.persist_directory, exist_ok=True)
+        self.db.save_local(self.persist_directory, index_name=self.name)
+        if self.bm25 is not None:
+            tmp_path = os.path.join(self.persist_directory, f"{self.name}.bm25.pkl.tmp")
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(self.bm25, f)
+            os.replace(tmp_path, os.path.join(self.persist_directory, f"{self.name}.bm25.pkl"))
+        tmp_path = os.path.join(self.persist_directory, f"{self.name}.manifest.json.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, os.path.join(self.persist_directory, f"{self.name}.manifest.json"))
+
+    def _load_persisted(self):
+        """
+        Reload the FAISS index and manifest from the persist directory if they exist.
+
+        With a shared index the manifest and the BM25 index are rebuilt from the chunks in the shared
+        index, which is saved separately and is the only reliable record of what was indexed.
+        """
+        if self.shared_index:
+            if self.shared_index.db is None:
+                return
+            self.manifest = self.shared_index.get_manifest(self.name)
+            if not self.manifest:
+                return
+            self.db = self.shared_index.db
+            if self.bm25 is not None:
+                ids = [id for entry in self.manifest.values() for id in entry['ids']]
+                self.bm25.add(ids, [self.db.docstore.search(id).page_content for id in ids])
+            if (self.debug_output): print(f"   {self.name} - Loaded {sum(len(entry['ids']) for entry in self.manifest.values())} chunks from the shared index")
+            return
+
+        manifest_path = os.path.join(self.persist_directory, f"{self.name}.manifest.json")
+        index_path = os.path.join(self.persist_directory, f"{self.name}.faiss")
+        if not os.path.exists(manifest_path) or not os.path.exists(index_path):
+            return
+        # The docstore is a pickle written by save(), only load directories you trust
+        self.db = FAISS.load_local(self.persist_directory, self.embeddings, index_name=self.name, allow_dangerous_deserialization=True)
+        if keeps_exact_vectors(self.index_type):
+            self._open_exact_vectors(self.db.index.d)
+            if len(self.exact_vectors) != self.db.index.ntotal:
+                # Missing or out of date (e.g. not saved after the last change), rebuild it once
+                self.exact_vectors.reset(get_vectors(self.db, self.embeddings))
+        with open(manifest_path, 'r') as f:
+            self.manifest = json.load(f)
+        if self.bm25 is not None:
+            bm25_path = os.path.join(self.persist_directory, f"{self.name}.bm25.pkl")
+            if os.path.exists(bm25_path):
+                with open(bm25_path, 'rb') as f:
+                    self.bm25 = pickle.load(f)
+            else:
+                # Hybrid search was enabled after the index was saved, build the inverted index from the docstore
+                ids = [id for entry in self.manifest.values() for id in entry['ids']]
+                self.bm25.add(ids, [self.db.docstore.search(id).page_content for id in ids])
+        if (self.debug_output): print(f"   {self.name} - Loaded {self.db.index.ntotal} chunks from {self.persist_directory}")
+
+    def _open_exact_vectors(self, dim: int = None):
+        """
+        Open the ExactVectors of the index, in the persist directory if one is set.
+        """
+        path = None
+        if self.persist_directory:
+            os.makedirs(self.persist_directory, exist_ok=True)
+            path = os.path.join(self.persist_directory, f"{self.name}.vectors.f32")
+        if self.exact_vectors is not None:
+            self.exact_vectors.close()
+        self.exact_vectors = ExactVectors(path, dim)
 
     def _reprocess_documents(self):
         """
-        Recreate the FAISS index based on the updated documents.
+        Embed the loaded documents and add them to the FAISS index.
+
+        Only the pending chunks in self.documents are embedded, they are cleared once indexed.
         """
         if not self.documents:
             raise RuntimeError("No documents loaded. Please load at least one document.")
         
-        if (self.debug_output): print(f"   {self.name} - Creating embeddings for document chunks...")
-        self.db = FAISS.from_documents(self.documents, self.embeddings)
-        
-        # Print the number of documents in FAISS index using ntotal
-        num_documents = self.db.index.ntotal
-        if (self.debug_output): print(f"   {self.name} - Number of chunks in FAISS index: {num_documents}")
+        if (self.debug_output): print(f"   {self.name} - Creating embeddings for {len(self.documents)} document chunks...")
+        documents, self.documents = self.documents, []
+        self.index_chunks(documents)
+
+    def index_chunks(self, chunks):
+        """
+        Embed chunks in batches and add them to the FAISS index.
+
+        :param chunks: Iterable of chunks, may be a generator so only one window of chunks is held in memory.
+        :return: Number of chunks added.
+        """
+        added = 0
+        for batch, vectors in self.embed_batches(chunks):
+            texts = [document.page_content for document in batch]
+            metadatas = [document.metadata for document in batch]
+            ids = [str(uuid.uuid4()) for _ in batch]
+            if self.shared_index:
+                # With the signature in the chunks the manifest can be rebuilt from the shared index, see _load_persisted
+                signatures = {source: self._get_source_signature(source) for source in {metadata.get('source') for metadata in metadatas}}
+                shared_metadatas = [dict(metadata, signature=signatures[metadata.get('source')]) for metadata in metadatas]
+                self.shared_index.add(self.name, texts, vectors, shared_metadatas, ids)
+                self.db = self.shared_index.db
+            elif self.db is None:
+                self.db = FAISS.from_embeddings(list(zip(texts, vectors)), self.embeddings, metadatas=metadatas, ids=ids)
+                if keeps_exact_vectors(self.index_type):
+                    self._open_exact_vectors()
+                    self.exact_vectors.reset(vectors)
+            else:
+                self.db.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+                if self.exact_vectors is not None:
+                    self.exact_vectors.append(vectors)
+            if self.bm25 is not None:
+                self.bm25.add(ids, texts)
+            for document, id in zip(batch, ids):
+                source = document.metadata.get('source')
+                entry = self.manifest.setdefault(source, {'signature': self._get_source_signature(source), 'ids': []})
+                entry['ids'].append(id)
+            added += len(batch)
+            self._fingerprint = None
+
+        if self.db is not None:
+            # Print the number of documents in FAISS index using ntotal
+            num_documents = self.db.index.ntotal
+            if (self.debug_output): print(f"   {self.name} - Number of chunks in FAISS index: {num_documents}")
+        return added
 
-    def get_document_retriever(self):
+    def embed_batches(self, chunks, window_batches: int = 8):
+        """
+        Embed chunks in batches of self.batch_size.
+
+        Chunks are read in windows of several batches and sorted by length within a window, so
+        each batch holds chunks of similar length and little padding is computed.
+
+        :param chunks: Iterable of chunks.
+        :param window_batches: Number of batches read and sorted together.
+        :return: Generator of (chunks, vectors) per batch.
+        """
+        chunks = iter(chunks)
+        while True:
+            window = list(islice(chunks, self.batch_size * window_batches))
+            if not window:
+                break
+            window.sort(key=lambda document: len(document.page_content))
+            for i in range(0, len(window), self.batch_size):
+                batch = window[i:i + self.batch_size]
+                start = time.perf_counter()
+                vectors = self.embeddings.embed_documents([document.page_content for document in batch])
+                self._update_embedding_stats(batch, time.perf_counter() - start)
+                yield batch, vectors
+
+    def _update_embedding_stats(self, batch, seconds):
+        self.embedding_stats['chunks'] += len(batch)
+        # Whitespace separated words as a cheap approximation of the token count
+        self.embedding_stats['tokens'] += sum(len(document.page_content.split()) for document in batch)
+        self.embedding_stats['seconds'] += seconds
+        if (self.debug_output):
+            stats = self.get_embedding_stats()
+            print(f"   {self.name} - Embedded {stats['chunks']} chunks ({stats['chunks_per_sec']:.1f} chunks/sec, {stats['tokens_per_sec']:.1f} tokens/sec)")
+
+    def get_embedding_stats(self):
+        """
+        Get the embedding throughput of this tool.
+
+        :return: Dict with chunks, tokens (approximate), seconds, chunks_per_sec and tokens_per_sec.
+        """
+        stats = dict(self.embedding_stats)
+        seconds = stats['seconds'] or float('inf')
+        stats['chunks_per_sec'] = stats['chunks'] / seconds
+        stats['tokens_per_sec'] = stats['tokens'] / seconds
+        return stats
+
+    def get_fingerprint(self):
+        """
+        Get a hash identifying the indexed content, it changes whenever chunks are added or removed.
+
+        :return: Hex digest of the tool name and the indexed sources and chunk ids.
+        """
+        if self._fingerprint is None:
+            content = json.dumps([self.name, self.manifest], sort_keys=True)
+            self._fingerprint = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        return self._fingerprint
+
+    def search_batch(self, queries, k: int = 4):
+        """
+        Retrieve the documents for many queries with one embedding batch and one FAISS search.
+        With hybrid search the BM25 results of each query are fused in.
+
+        :param queries: List of query strings.
+        :param k: Number of documents per query.
+        :return: List with the list of documents for each query.
+        """
+        if not self.db:
+            raise RuntimeError("No documents have been processed. Please load documents before searching.")
+        if self.bm25 is not None:
+            results = self._hybrid_search_ids(queries, k)
+        else:
+            results = self._search_ids(queries, k)
+        return [[self.db.docstore.search(id) for id in ids] for ids in results]
+
+    def _search_ids(self, queries, k):
+        """
+        Vector search returning the docstore ids of the documents.
+        """
+        if self.shared_index:
+            return self.shared_index.search_ids(queries, k, [self.name])
+        return similarity_search_ids(self.db, self.embeddings, queries, k, self.rerank, self.exact_vectors)
+
+    def _hybrid_search_ids(self, queries, k, rrf_k: int = 60):
+        """
+        Fuse the vector and the BM25 results of each query with reciprocal rank fusion.
+
+        Both searches fetch more candidates than k, so documents ranked lower by one of them
+        but found by both can move up.
+        """
+        fetch_k = max(4 * k, 20)
+        results = []
+        for query, vector_ids in zip(queries, self._search_ids(queries, fetch_k)):
+            keyword_ids = [id for id, _ in self.bm25.search(query, fetch_k)]
+            # Keyword results first, an exact match ranked first by BM25 wins a tie with the first vector result
+            results.append(reciprocal_rank_fusion([keyword_ids, vector_ids], rrf_k)[:k])
+        return results
+
+    def get_document_retriever(self, k: int = 4):
         """
         Get the document retriever from the FAISS index.
+
+        With a shared index the retriever only returns chunks of this tool.
         
+        :param k: Number of documents returned per query.
         :return: FAISS retriever
         """
         if not self.db:
             raise RuntimeError("No documents have been processed. Please load documents before getting retriever.")
-        return self.db.as_retriever()
\ No newline at end of file
+        if self.shared_index or self.rerank or self.bm25 is not None:
+            return SearchRetriever(search=self.search_batch, k=k)
+        return self.db.as_retriever(search_kwargs={'k': k})
\ No newline at end of file
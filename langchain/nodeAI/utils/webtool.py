@@ -1,14 +1,20 @@
+import asyncio
+import hashlib
 import requests
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, FeatureNotFound
 from langchain_text_splitters import CharacterTextSplitter
 from urllib.parse import urljoin, urlparse
-from collections import deque
 import time
 
 from .tool import Tool, Document
+from .http_cache import HttpCache
 
 class WebTool(Tool):
-    def __init__(self, name: str, urls: list, follow_redirects: bool = False, max_depth: int = 0):
+    def __init__(self, name: str, urls: list, follow_redirects: bool = False, max_depth: int = 0,
+                 concurrency: int = 8, requests_per_second: float = 10.0, timeout: float = 30.0,
+                 parser: str = 'html.parser', http_cache_dir: str = None, **kwargs):
         """
         Initialize the WebTool class with a list of URLs and options for subpages and depth limit.
         
@@ -16,54 +22,153 @@ class WebTool(Tool):
         :param urls: List of URLs to be loaded and processed.
         :param subpages: Boolean to specify whether to include subpages.
         :param max_depth: Maximum depth to crawl the website.
+        :param concurrency: Maximum number of requests in flight while crawling.
+        :param requests_per_second: Maximum rate of requests started per host.
+        :param timeout: Timeout of a single request in seconds.
+        :param parser: BeautifulSoup parser backend, e.g. 'html.parser' or the faster 'lxml' (requires lxml).
+        :param http_cache_dir: Optional directory of an HTTP cache, unchanged pages are revalidated with
+                               conditional requests (ETag / Last-Modified) instead of downloaded again.
+        :param kwargs: Additional options passed to Tool (e.g. embedding_model).
         """
-        super().__init__(name, urls) 
+        try:
+            BeautifulSoup("", parser)
+        except FeatureNotFound:
+            raise ValueError(f"Parser '{parser}' is not available, install it or use 'html.parser'.")
+        super().__init__(name, urls, **kwargs)
         self.follow_redirects = follow_redirects
         self.max_depth = max_depth
+        self.concurrency = concurrency
+        self.requests_per_second = requests_per_second
+        self.timeout = timeout
+        self.parser = parser
+        self.http_cache = HttpCache(http_cache_dir) if http_cache_dir else None
+        self.page_signatures = {}
+        self._changed_pages = []
+        # One pooled keep-alive session for all requests of this tool
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         self.base_domain = self._get_base_domain(urls[0])
         self.load()
     
     def load(self):
         """
         Collect all pages including subpages from the starting URLs up to a specified depth.
+
+        Inside a running event loop (e.g. an async server) the crawl runs in a worker thread,
+        use aload() there to load without blocking the loop.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(self.crawl())
+        else:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                executor.submit(asyncio.run, self.crawl()).result()
+        super().load()
+
+    async def aload(self):
+        """
+        Async variant of load() for callers running in an event loop.
+        """
+        await self.crawl()
+        await asyncio.to_thread(super().load)
+
+    async def crawl(self):
         """
-        #self.sources = set()
-        queue = deque([(url, 0) for url in self.sources])
+        Crawl the starting URLs breadth first up to max_depth and add the chunks of all pages.
 
+        Pages of one depth level are fetched concurrently (at most self.concurrency requests in
+        flight, at most self.requests_per_second requests started per host), the links found on
+        them form the next level. Only links within the base domain pointing to HTML pages or
+        directories are followed.
+        Pages whose text is unchanged since they were indexed keep their chunks, only changed
+        pages are chunked and embedded again. The chunks of pages no longer linked are removed
+        by Tool.load(), pages which could not be fetched keep their chunks.
+        """
+        level = list(dict.fromkeys(self.sources))
         self.sources = []
-        
-        while queue:
-            url, depth = queue.popleft()
-            if url in self.sources or depth > self.max_depth:
-                continue
-
-            self.add_source(url)
-            #self.sources.add(url)
-            self.load_webpage(url, depth)
-            
+        self._changed_pages = []
+        semaphore = asyncio.Semaphore(self.concurrency)
+        host_slots = {}
+
+        depth = 0
+        while level and depth <= self.max_depth:
+            for url in level:
+                self.add_source(url)
+            pages = await asyncio.gather(*[self._crawl_page(url, depth, semaphore, host_slots) for url in level])
+
+            next_level = []
             if self.follow_redirects and depth < self.max_depth:
-                try:
-                    response = requests.get(url)
-                    response.raise_for_status()
-                except (requests.RequestException, requests.HTTPError) as e:
-                    print(f"Failed to retrieve the webpage {url}: {e}")
-                    continue
-                
-                soup = BeautifulSoup(response.text, 'html.parser')
-                for a_tag in soup.find_all('a', href=True):
-                    link = a_tag['href']
-                    full_url = urljoin(url, link)
-                    parsed_url = urlparse(full_url)
-                    
-                    # Normalize and check if the URL is within the same base domain
-                    if parsed_url.netloc.lower() == self.base_domain and full_url not in self.sources:
-                        # Check if the URL points to an HTML page or directory
-                        if self._is_html_or_directory(full_url):
-                            queue.append((full_url, depth + 1))
-                
-                time.sleep(1)
-        super().load()
+                for links in pages:
+                    for full_url in links:
+                        if full_url not in self.sources and full_url not in next_level:
+                            next_level.append(full_url)
+            level = next_level
+            depth += 1
+
+        # Drop the outdated chunks of changed pages in one removal
+        self.remove_sources(self._changed_pages)
+
+    async def _crawl_page(self, url, depth, semaphore, host_slots):
+        """
+        Fetch a page, add its chunks if it changed and return the links to follow.
+
+        Errors are logged and end only the crawl of this page.
+        """
+        try:
+            await self._wait_for_host(url, host_slots)
+            async with semaphore:
+                print(f"   {self.name} - Loading {url} ({depth} / {self.max_depth})")
+                page = await asyncio.to_thread(self.fetch_page, url)
+            if page is None:
+                return []
 
+            text, links = page
+            signature = hashlib.sha256(text.encode('utf-8')).hexdigest()
+            self.page_signatures[url] = signature
+            entry = self.manifest.get(url)
+            if entry is not None and entry['signature'] == signature:
+                if (self.debug_output): print(f"   {self.name} - Unchanged, keeping the chunks of {url}")
+            else:
+                self._changed_pages.append(url)
+                self._add_page_text(url, text)
+        except Exception as e:
+            print(f"Failed to crawl the webpage {url}: {e}")
+            return []
+        if not self.follow_redirects or depth >= self.max_depth:
+            return []
+        return links
+
+    async def _wait_for_host(self, url, host_slots):
+        """
+        Wait until the next request to the host of the URL may be started.
+
+        :param host_slots: Dict of host to the earliest start time of its next request.
+        """
+        if not self.requests_per_second:
+            return
+        host = urlparse(url).netloc.lower()
+        now = time.monotonic()
+        start = max(now, host_slots.get(host, now))
+        host_slots[host] = start + 1.0 / self.requests_per_second
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+    def _get_source_signature(self, source):
+        """
+        Get the hash of the text of a crawled page, used to detect unchanged pages.
+        """
+        return self.page_signatures.get(source)
+
+    def release(self):
+        """
+        Close the HTTP session and release the shared embedding model.
+        """
+        self.session.close()
+        super().release()
 
     def load_webpages(self, urls):
         """
@@ -84,13 +189,63 @@ class WebTool(Tool):
         """
         print(f"   {self.name} - Loading {url} ({depth} / {self.max_depth})")
 
-        response = requests.get(url)
+        page = self.fetch_page(url)
+        if page is not None:
+            text, _ = page
+            self._add_page_text(url, text)
+
+    def fetch_page(self, url):
+        """
+        Download a webpage and parse it once into its text and the links to follow.
+
+        :param url: URL of the webpage to be fetched.
+        :return: Tuple of (text, links) or None if the page could not be retrieved.
+        """
+        cached = self.http_cache.get(url) if self.http_cache else None
+        headers = self.http_cache.get_conditional_headers(cached) if cached else {}
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            print(f"Failed to retrieve the webpage {url}: {e}")
+            return None
+        if response.status_code == 304 and cached:
+            if (self.debug_output): print(f"   {self.name} - Not modified, using cached page {url}")
+            return self._parse_page(url, cached['body'])
         if response.status_code != 200:
             print(f"Failed to retrieve the webpage {url}: {response.status_code}")
-            return
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
+            return None
+        if self.http_cache:
+            self.http_cache.put(url, response)
+        return self._parse_page(url, response.text)
+
+    def _parse_page(self, url, html):
+        """
+        Parse the HTML of a webpage into its text and the links within the base domain
+        pointing to HTML pages or directories.
+
+        :param url: URL of the webpage, used to resolve relative links.
+        :param html: HTML content of the webpage.
+        :return: Tuple of (text, links).
+        """
+        soup = BeautifulSoup(html, self.parser)
+        links = []
+        for a_tag in soup.find_all('a', href=True):
+            full_url = urljoin(url, a_tag['href'])
+            parsed_url = urlparse(full_url)
+            # Normalize and check if the URL is within the same base domain
+            if parsed_url.netloc.lower() == self.base_domain and self._is_html_or_directory(full_url):
+                if full_url not in links:
+                    links.append(full_url)
         text = soup.get_text(separator='\n', strip=True)
+        return text, links
+
+    def _add_page_text(self, url, text):
+        """
+        Split the text of a webpage into chunks and add them to the collection.
+
+        :param url: URL of the webpage.
+        :param text: Text content of the webpage.
+        """
         if (self.debug_output): 
             print(f"   {self.name} - Splitting into chunks...")
         document = Document(content=text, metadata={'source': url})
@@ -1,11 +1,17 @@
 import warnings
 from langchain.chains import RetrievalQA
 from langchain_community.document_loaders import PDFPlumberLoader
-from langchain_community.llms import Ollama
 from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_text_splitters import CharacterTextSplitter
 
+from nodeAI.utils.embeddings import EmbeddingPool
+from nodeAI.utils.embedding_cache import EmbeddingCache, CachedEmbeddings
+from nodeAI.utils.ragtool import iter_chunks
+from nodeAI.utils.tool import SearchRetriever, similarity_search_batch
+from nodeAI.utils.agent import format_stuff_prompt
+from nodeAI.utils.llm_registry import LLMRegistry
+from nodeAI.utils.ann_index import ExactVectors, convert_index, evaluate_index, keeps_exact_vectors
+
 warnings.filterwarnings('ignore')
 
 class Document:
@@ -17,17 +23,47 @@ class Document:
         self.metadata = metadata or {}
 
 class RAG:
-    def __init__(self, model: str):
+    def __init__(self, model: str, cache_dir: str = None, streaming: bool = False, batch_size: int = 64,
+                 index_type: str = 'flat', index_params: dict = None, rerank: int = 0):
         """
         Initialize the RAG class with a specific model.
         
         :param model: The model name for the language model.
+        :param cache_dir: Optional directory of a persistent embedding cache.
+        :param streaming: Stream chunks from the files into the index in batches without keeping them in self.documents.
+        :param batch_size: Number of chunks embedded at once in streaming mode.
+        :param index_type: FAISS index type: 'flat' (exact), 'ivf', 'hnsw', 'pq', 'fp16', 'int8' or 'auto' to choose by the number of chunks.
+        :param index_params: Optional index settings, see nodeAI.utils.ann_index.build_index.
+        :param rerank: Over-fetch factor for compressed indexes, k * rerank candidates are re-ranked with exact vectors
+                       (kept in a memory-mapped temporary file).
         """
         self.model_name = model
+        self.streaming = streaming
+        self.batch_size = batch_size
+        self.index_type = index_type
+        self.index_params = index_params
+        self.rerank = rerank
         self.documents = []
         self.chain = None
-        self.embeddings = HuggingFaceEmbeddings()
+        self.embedding_model = EmbeddingPool.acquire()
+        self.embeddings = self.embedding_model
+        if cache_dir:
+            self.embeddings = CachedEmbeddings(self.embedding_model, EmbeddingCache.open(cache_dir))
         self.db = None
+        self.exact_vectors = ExactVectors() if keeps_exact_vectors(index_type) else None
+
+    def release(self):
+        """
+        Release the shared embedding model and the exact vectors held by this instance.
+        """
+        self._flush_embedding_cache()
+        if self.embedding_model is not None:
+            EmbeddingPool.release(self.embedding_model)
+            self.embedding_model = None
+            self.embeddings = None
+        if self.exact_vectors is not None:
+            self.exact_vectors.close()
+            self.exact_vectors = None
     
     def load_pdf(self, file_path):
         """
@@ -35,6 +71,9 @@ class RAG:
         
         :param file_path: Path to the PDF file.
         """
+        if self.streaming:
+            return self._load_streaming(file_path)
+
         loader = PDFPlumberLoader(file_path)
         docs = loader.load()
         
@@ -52,8 +91,9 @@ class RAG:
         print(f"   Adding to the collection...")
         self.documents.extend(texts)
         
-        # Reprocess documents to update the FAISS index
-        self._reprocess_documents()
+        # Embed only the new chunks and append them to the FAISS index
+        self._add_documents(texts)
+        self._flush_embedding_cache()
     
     def load_txt(self, file_path):
         """
@@ -61,6 +101,8 @@ class RAG:
         
         :param file_path: Path to the text file.
         """
+        if self.streaming:
+            return self._load_streaming(file_path)
 
         with open(file_path, 'r', encoding='utf-8') as file:
             text = file.read()
@@ -81,30 +123,112 @@ class RAG:
         print(f"   Adding to the collection...")
         self.documents.extend(texts)
         
-        # Reprocess documents to update the FAISS index
-        self._reprocess_documents()
+        # Embed only the new chunks and append them to the FAISS index
+        self._add_documents(texts)
+        self._flush_embedding_cache()
     
-    def _reprocess_documents(self):
-        """
-        Recreate the FAISS index and retrieval chain based on the updated documents.
+    def _load_streaming(self, file_path):
         """
-        if not self.documents:
-            raise RuntimeError("No documents loaded. Please load at least one document.")
+        Stream the chunks of a file into the FAISS index in batches, the chunks are not kept in self.documents.
         
-        print("   Creating embeddings for document chunks...")
-        self.db = FAISS.from_documents(self.documents, self.embeddings)
+        :param file_path: Path to the PDF or text file.
+        """
+        print(f"   Streaming chunks into the collection...")
+        batch = []
+        for text in iter_chunks(file_path):
+            batch.append(text)
+            if len(batch) >= self.batch_size:
+                self._add_documents(batch)
+                batch = []
+        self._add_documents(batch)
+        self._flush_embedding_cache()
+
+    def _flush_embedding_cache(self):
+        """
+        Write the embedding cache to disk once per file instead of after every batch.
+        """
+        if isinstance(self.embeddings, CachedEmbeddings):
+            self.embeddings.flush()
+
+    def _add_documents(self, texts):
+        """
+        Embed the given chunks and append them to the FAISS index.
+
+        Only the new chunks are embedded; previously indexed chunks are kept as they are.
+        The retrieval chain is reset and rebuilt lazily on the next query.
+
+        :param texts: List of document chunks to be added.
+        """
+        if not texts:
+            return
+
+        print(f"   Creating embeddings for {len(texts)} new document chunks...")
+        vectors = self.embeddings.embed_documents([text.page_content for text in texts])
+        text_embeddings = [(text.page_content, vector) for text, vector in zip(texts, vectors)]
+        metadatas = [text.metadata for text in texts]
+        if self.db is None:
+            self.db = FAISS.from_embeddings(text_embeddings, self.embeddings, metadatas=metadatas)
+            if self.exact_vectors is not None:
+                self.exact_vectors.reset(vectors)
+        else:
+            self.db.add_embeddings(text_embeddings, metadatas=metadatas)
+            if self.exact_vectors is not None:
+                self.exact_vectors.append(vectors)
         
         # Print the number of documents in FAISS index using ntotal
         num_documents = self.db.index.ntotal
         print(f"   Number of chunks in FAISS index: {num_documents}")
 
+        # The chain holds a retriever on the current index, rebuild it on the next query
+        self.chain = None
+
+    def _reprocess_documents(self):
+        """
+        Recreate the FAISS index from all loaded documents (full rebuild).
+        """
+        if not self.documents:
+            raise RuntimeError("No documents loaded. Please load at least one document.")
+        
+        self.db = None
+        self._add_documents(self.documents)
+
+    def _setup_chain(self):
+        """
+        Set up the retrieval chain on the current FAISS index.
+        """
+        if self.db is None:
+            raise RuntimeError("No documents loaded. Please load documents before querying.")
+
         print("   Setting up the retrieval chain...")
-        llm = Ollama(model=self.model_name)
+        # New chunks are added to the current index, convert it once the documents are loaded
+        print(f"   FAISS index type: {convert_index(self.db, self.embeddings, self.index_type, self.index_params, self.exact_vectors)}")
+        # Rebuilding the chain after new documents reuses the shared client
+        self.llm = LLMRegistry.get('Ollama', self.model_name)
+        if self.rerank:
+            self.retriever = SearchRetriever(search=self._search_batch)
+        else:
+            self.retriever = self.db.as_retriever()
         self.chain = RetrievalQA.from_chain_type(
-            llm,
-            retriever=self.db.as_retriever()
+            self.llm,
+            retriever=self.retriever
         )
 
+    def _search_batch(self, questions, k):
+        return similarity_search_batch(self.db, self.embeddings, questions, k, self.rerank, self.exact_vectors)
+
+    def evaluate_index(self, questions: list = None, k: int = 4):
+        """
+        Report the recall@k, search latency and memory of the FAISS index compared to an exact flat index.
+
+        :param questions: Optional questions, by default a sample of the indexed chunks is used.
+        :param k: Number of results per query.
+        :return: Dict with index_type, ntotal, recall_at_k, latency_p50_ms, latency_p99_ms, memory_bytes, memory_saved
+                 and the flat baseline latencies and memory.
+        """
+        if not self.chain:
+            self._setup_chain()
+        return evaluate_index(self.db, self.embeddings, questions, k, rerank=self.rerank, exact_vectors=self.exact_vectors)
+
     def query(self, question: str):
         """
         Query the loaded documents with a question.
@@ -113,12 +237,73 @@ class RAG:
         :return: The result of the query.
         """
         if not self.chain:
-            raise RuntimeError("No documents loaded. Please load documents before querying.")
+            self._setup_chain()
         
         print(f"Agent query: {question}")
         result = self.chain.invoke({"query": question})
         return result['result']
 
+    def stream_query(self, question: str):
+        """
+        Query the loaded documents and yield the answer while it is generated.
+        
+        :param question: The question to be asked.
+        :return: Generator of dicts, first {"type": "sources", "documents": [...]}, then {"type": "token", "content": str}.
+        """
+        if not self.chain:
+            self._setup_chain()
+
+        print(f"Agent query: {question}")
+        documents = self.retriever.invoke(question)
+        yield {"type": "sources", "documents": documents}
+        for token in self.llm.stream(format_stuff_prompt(self.chain, documents, question)):
+            yield {"type": "token", "content": token}
+
+    async def astream_query(self, question: str):
+        """
+        Async variant of stream_query.
+        
+        :param question: The question to be asked.
+        :return: Async generator of the same dicts as stream_query.
+        """
+        if not self.chain:
+            self._setup_chain()
+
+        print(f"Agent query: {question}")
+        documents = await self.retriever.ainvoke(question)
+        yield {"type": "sources", "documents": documents}
+        async for token in self.llm.astream(format_stuff_prompt(self.chain, documents, question)):
+            yield {"type": "token", "content": token}
+
+    def query_batch(self, questions: list, k: int = 4, max_concurrency: int = 4):
+        """
+        Query the loaded documents with many questions at once.
+
+        All questions are embedded in one batch and retrieved with one FAISS search, the LLM
+        calls are dispatched with bounded concurrency.
+        
+        :param questions: List of questions.
+        :param k: Number of documents retrieved per question.
+        :param max_concurrency: Maximum number of LLM calls running at the same time.
+        :return: List of dicts with question, result and error (None on success), in the order of the questions.
+        """
+        if not self.chain:
+            self._setup_chain()
+
+        print(f"Agent batch query: {len(questions)} questions")
+        documents = self._search_batch(questions, k)
+        outputs = self.chain.combine_documents_chain.batch(
+            [{"input_documents": docs, "question": question} for question, docs in zip(questions, documents)],
+            config={"max_concurrency": max_concurrency}, return_exceptions=True
+        )
+        results = []
+        for question, output in zip(questions, outputs):
+            if isinstance(output, Exception):
+                results.append({"question": question, "result": None, "error": str(output)})
+            else:
+                results.append({"question": question, "result": output["output_text"], "error": None})
+        return results
+
 # Example usage:
 
 pdf_paths = [
@@ -183,9 +368,8 @@ Loading PDF: /Users/markusfreyt/Development/Projects/AI/langchain/docs/test.pdf.
      -->  Sie regelmäßig alle Zimmer der Wohnung. Wenn Sie k
      -->  4. Informieren Sie Ihre Haushaltsangehörigen!• Tei
    Adding to the collection...
-   Creating embeddings for document chunks...
+   Creating embeddings for 3 new document chunks...
    Number of chunks in FAISS index: 3
-   Setting up the retrieval chain...
 
 Loading TXT: /Users/markusfreyt/Development/Projects/AI/langchain/docs/kunst.txt...
    Splitting into chunks...
@@ -193,9 +377,8 @@ Loading TXT: /Users/markusfreyt/Development/Projects/AI/langchain/docs/kunst.txt
      -->  Das Wort Kunst (lateinisch ars, griechisch téchne[
      -->  Literatur mit den Hauptgattungen Epik, Dramatik, L
    Adding to the collection...
-   Creating embeddings for document chunks...
+   Creating embeddings for 2 new document chunks...
    Number of chunks in FAISS index: 5
-   Setting up the retrieval chain...
 
 Loading TXT: /Users/markusfreyt/Development/Projects/AI/langchain/docs/test.txt...
    Splitting into chunks...
@@ -203,10 +386,10 @@ Loading TXT: /Users/markusfreyt/Development/Projects/AI/langchain/docs/test.txt.
      -->  Die Burg Eltz ist das Ergbnis eines kreativen Proz
      -->  den Eltz-Kempenich, genannt „Eltz vom goldenen Löw
    Adding to the collection...
-   Creating embeddings for document chunks...
+   Creating embeddings for 2 new document chunks...
    Number of chunks in FAISS index: 7
-   Setting up the retrieval chain...
 
+   Setting up the retrieval chain...
 Agent query: In the documents information about three topics Covid, Burg Eltz and Kunst are provided. Can you please summarize each of all three topics by only one sentence in german?
 --------------------------
 Hier sind die Zusammenfassungen: